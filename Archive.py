@@ -0,0 +1,49 @@
+import os
+import pathlib
+import numpy as np
+
+# One fixed width record per sample so the archive can be memory mapped and indexed directly
+ARCHIVE_DTYPE = np.dtype([('time', '<i8'), ('datum', '<f8')])
+
+
+class BufferArchive:
+    """Append-only on-disk spill tier for the points a Buffer evicts, read back through a memory map"""
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'ab')
+        self._memmap = None
+
+    def __len__(self):
+        return os.path.getsize(self.path) // ARCHIVE_DTYPE.itemsize
+
+    def close(self):
+        self._file.close()
+        self._memmap = None
+
+    def append(self, times: np.ndarray, data: np.ndarray):
+        if len(times) == 0:
+            return
+        records = np.empty(len(times), dtype=ARCHIVE_DTYPE)
+        records['time'] = times
+        records['datum'] = data
+        self._file.write(records.tobytes())
+        # Flushed so memory mapped readers see the new records straight away
+        self._file.flush()
+
+    def records(self) -> np.ndarray:
+        count = len(self)
+        if self._memmap is None or len(self._memmap) != count:
+            # The file only grows, re-map it when new records have been appended since the last read
+            self._memmap = np.memmap(self.path, dtype=ARCHIVE_DTYPE, mode='r', shape=(count,)) if count else \
+                np.empty(0, dtype=ARCHIVE_DTYPE)
+        return self._memmap
+
+    def range_by_time(self, start_time=None, end_time=None) -> tuple[np.ndarray, np.ndarray]:
+        """Times and data with start_time <= time <= end_time, as views onto the memory map (nothing is loaded
+        until it is used)"""
+        records = self.records()
+        times = records['time']
+        start = 0 if start_time is None else int(np.searchsorted(times, start_time, side='left'))
+        end = len(records) if end_time is None else int(np.searchsorted(times, end_time, side='right'))
+        return times[start:end], records['datum'][start:end]
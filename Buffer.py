@@ -1,141 +1,264 @@
-import collections
-from typing import Callable, Union
-import time
-import os
+from typing import Callable
+from dataclasses import dataclass
+import functools
+import weakref
+import numpy as np
+import Archive
+import DataSources
 from Config import Config
 from datetime import datetime
 
 
 DEFAULT_BUFFER_SIZE = Config.get('DEFAULT_BUFFER_SIZE')
-TIME_FACTOR = Config.get('TIME_FACTOR')
+RING_BUFFER_INITIAL_POINTS = Config.get('RING_BUFFER_INITIAL_POINTS')
+
+
+def time_unit(capacity_type: str) -> str:
+    # Buffers measured in seconds hold times in microseconds, every other buffer in milliseconds
+    return 'us' if capacity_type == 's' else 'ms'
+
+
+def to_datetime64(times, unit: str = 'ms') -> np.ndarray:
+    """Local wall clock datetime64 values for epoch times, the vectorized equivalent of datetime.fromtimestamp. The
+    UTC offset in force at the newest time is applied to all of them."""
+    times = np.asarray(times, dtype=np.int64)
+    if times.size == 0:
+        return np.empty(0, dtype=f'datetime64[{unit}]')
+    newest_seconds = int(times[-1]) / (1000000.0 if unit == 'us' else 1000.0)
+    offset = datetime.fromtimestamp(newest_seconds).astimezone().utcoffset()
+    return times.astype(f'datetime64[{unit}]') + np.timedelta64(offset).astype(f'timedelta64[{unit}]')
+
+
+@dataclass
+class BufferSnapshot:
+    name: str
+    time: np.ndarray
+    data: np.ndarray
+    time_unit: str = 'ms'
+
+    @functools.cached_property
+    def timestamps(self) -> np.ndarray:
+        return to_datetime64(self.time, self.time_unit)
 
 
 class Buffer:
     def __init__(self, name: str, fill_function: Callable,
-                 capacity: int = DEFAULT_BUFFER_SIZE, capacity_type: str = 'ms'):
+                 capacity: int = DEFAULT_BUFFER_SIZE, capacity_type: str = 'ms', archive: Archive.BufferArchive = None):
         self.name = name
-        self.fill_function = fill_function  # Fill function should return a tuple of timestamp, datum
+        # Fill function should return a tuple of timestamp, datum or a tuple of equal length time and data arrays
+        self.fill_function = fill_function
         self.capacity = capacity
         self.capacity_type = capacity_type
-        self.data = collections.deque()
-        self.time = collections.deque()
-        self.timestamps = collections.deque()
+        self.archive = archive  # When set, points evicted from the buffer are spilled to it rather than discarded
+        self.total_points = 0  # Running count of every point ever added, it is not reset when the data is cleared
+        self.generation = 0  # Bumped whenever the data is cleared, so state carried over from older points can be reset
+        self._timestamp_cache = None
+        self._eviction_listeners: list[weakref.WeakMethod] = []
+        # Rolling moments of windows over this buffer, shared by every statistic reading them (see
+        # statistics.shared_moments). Held by the buffer so they are released with it.
+        self.shared_moments = {}
+        self._allocate(self._initial_slots())
 
     def __len__(self):
-        return len(self.data)
+        return self._end - self._start
+
+    def _initial_slots(self):
+        if self.capacity_type == 'points':
+            return int(self.capacity)
+        return RING_BUFFER_INITIAL_POINTS
+
+    def _allocate(self, slots: int):
+        # The stores are twice the number of live slots so the live region [_start, _end) is always contiguous and
+        # can be handed out as a view. When writing reaches the end of a store the live region is moved to the front.
+        self._time_store = np.empty(2 * slots, dtype=np.int64)
+        self._data_store = np.empty(2 * slots, dtype=np.float64)
+        self._start = 0
+        self._end = 0
+
+    @property
+    def time(self) -> np.ndarray:
+        return self._time_store[self._start:self._end]
+
+    @property
+    def data(self) -> np.ndarray:
+        return self._data_store[self._start:self._end]
+
+    @property
+    def time_unit(self) -> str:
+        return time_unit(self.capacity_type)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        # Derived from the times when asked for, the last conversion is kept until the buffer changes
+        key = (self.total_points, len(self))
+        if self._timestamp_cache is None or self._timestamp_cache[0] != key:
+            self._timestamp_cache = (key, to_datetime64(self.time, self.time_unit))
+        return self._timestamp_cache[1]
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
 
     def clear_data(self):
-        self.data = collections.deque()
-        self.time = collections.deque()
-        self.timestamps = collections.deque()
+        self._allocate(self._initial_slots())
+        self.generation += 1
+
+    def snapshot(self) -> BufferSnapshot:
+        return BufferSnapshot(name=self.name, time=self.time.copy(), data=self.data.copy(), time_unit=self.time_unit)
 
     def fill_next_frame(self):
-        if self.capacity_type == 'points' and len(self) == self.capacity:
-            self.data.popleft()
-            self.time.popleft()
-            self.timestamps.popleft()
+        raw_time, datum = self.fill_function()
+        return self._push(raw_time, datum)
 
-        if self.capacity_type in ('ms', 's'):
-            while self.get_timespan() >= self.capacity:
-                self.data.popleft()
-                self.time.popleft()
-                self.timestamps.popleft()
+    def append(self, new_time, new_data) -> int:
+        """Adds points read elsewhere, rather than by the fill function, evicting as a frame would"""
+        return self._push(new_time, new_data)
 
-        raw_time, datum = self.fill_function()
-        self.time.append(raw_time)
-        self.data.append(datum)
-        self._add_new_timestamp(raw_time)
+    def _push(self, new_time, new_data):
+        new_time = np.atleast_1d(np.asarray(new_time, dtype=np.int64))
+        new_data = np.atleast_1d(np.asarray(new_data, dtype=np.float64))
+        if self.capacity_type == 'points':
+            if new_time.size > self.capacity:
+                # The head of the batch can never be held, it is spilled as if it had been added and evicted
+                self._evict(len(self))
+                dropped = new_time.size - int(self.capacity)
+                self._spill(new_time[:dropped], new_data[:dropped], self.total_points)
+                self.total_points += dropped
+                new_time = new_time[dropped:]
+                new_data = new_data[dropped:]
+            # Drop the oldest points up front so a points buffer never needs to grow
+            self._evict(max(0, len(self) + new_time.size - self.capacity))
+
+        num_new = new_time.size
+        if num_new == 0:
+            return 0
+
+        needed = len(self) + num_new
+        if self._end + num_new > self._time_store.size:
+            if needed > self._time_store.size // 2:
+                self._grow(needed)
+            else:
+                self._compact()
+
+        self._time_store[self._end:self._end + num_new] = new_time
+        self._data_store[self._end:self._end + num_new] = new_data
+        self._end += num_new
+        self.total_points += num_new
+
+        if self.capacity_type in ('ms', 's') and len(self) > 1:
+            times = self.time
+            self._evict(int(np.searchsorted(times, times[-1] - self.capacity, side='right')))
+        return num_new
+
+    def on_evict(self, listener: Callable):
+        """Calls the bound method listener(first_index, data) with the points about to be evicted, first_index being
+        the absolute index (see total_points) of the first of them. Only held weakly."""
+        self._eviction_listeners.append(weakref.WeakMethod(listener))
+
+    def _evict(self, num_points: int):
+        if num_points <= 0:
+            return
+        self._spill(self._time_store[self._start:self._start + num_points],
+                    self._data_store[self._start:self._start + num_points], self.total_points - len(self))
+        self._start += num_points
 
-    def _add_new_timestamp(self, new_time: Union[int, float]):
-        if self.capacity_type == 'ms':
-            self.timestamps.append(datetime.fromtimestamp(new_time / 1000.0))
-        elif self.capacity_type == 's':
-            self.timestamps.append(datetime.fromtimestamp(new_time / 1000000.0))
+    def _spill(self, times: np.ndarray, data: np.ndarray, first_index: int):
+        # Hands points leaving the buffer to the archive and the eviction listeners
+        if self.archive is not None:
+            self.archive.append(times, data)
+        if self._eviction_listeners:
+            self._eviction_listeners = [listener for listener in self._eviction_listeners if listener() is not None]
+            for listener in self._eviction_listeners:
+                listener()(first_index, data)
+
+    def _compact(self):
+        size = len(self)
+        self._time_store[:size] = self._time_store[self._start:self._end]
+        self._data_store[:size] = self._data_store[self._start:self._end]
+        self._start, self._end = 0, size
+
+    def _grow(self, needed: int):
+        old_time, old_data = self.time, self.data
+        self._allocate(max(self._time_store.size, needed))
+        size = old_time.size
+        self._time_store[:size] = old_time
+        self._data_store[:size] = old_data
+        self._end = size
+
+    def range_by_time(self, start_time=None, end_time=None) -> tuple[np.ndarray, np.ndarray]:
+        """Times and data with start_time <= time <= end_time, taken from the archive as well as the live buffer"""
+        times = self.time
+        start = 0 if start_time is None else int(np.searchsorted(times, start_time, side='left'))
+        end = len(times) if end_time is None else int(np.searchsorted(times, end_time, side='right'))
+        if self.archive is None or (len(self) and start_time is not None and start_time >= times[0]):
+            return times[start:end], self.data[start:end]
+        archived_times, archived_data = self.archive.range_by_time(start_time, end_time)
+        return np.concatenate([archived_times, times[start:end]]), np.concatenate([archived_data, self.data[start:end]])
 
     def get_timespan(self):
         if len(self) > 1:
-            return self.time[-1] - self.time[0]
+            return int(self._time_store[self._end - 1] - self._time_store[self._start])
         else:
             return 0
 
-    def tail_time(self, n, step: int = 1):
-        if len(self.time) < n * step:
-            return list(self.time)
-        return [self.time[-1 - (i * step)] for i in range(n)][::-1]
+    @staticmethod
+    def _tail(values: np.ndarray, n, step: int = 1) -> np.ndarray:
+        n = int(n)
+        if len(values) < n * step:
+            return values
+        return values[len(values) - 1 - (n - 1) * step::step]
+
+    def tail_time(self, n, step: int = 1) -> np.ndarray:
+        return self._tail(self.time, n, step)
 
-    def tail_data(self, n, step: int = 1):
-        if len(self.data) < n * step:
-            return list(self.data)
-        return [self.data[-1 - (i * step)] for i in range(n)][::-1]
+    def tail_data(self, n, step: int = 1) -> np.ndarray:
+        return self._tail(self.data, n, step)
 
-    def tail_timestamps(self, n, step: int = 1) -> list:
-        if len(self.timestamps) < n * step:
-            return list(self.timestamps)
-        return [self.timestamps[-1 - (i * step)] for i in range(n)][::-1]
+    def tail_timestamps(self, n, step: int = 1) -> np.ndarray:
+        return to_datetime64(self.tail_time(n, step), self.time_unit)
+
+    def window_start_index(self, duration) -> int:
+        # Index into the live region of the first point of a trailing time window. As with the original backward
+        # scan, the newest point older than the window is kept so the window spans the full duration.
+        if len(self) == 0:
+            return 0
+        times = self.time
+        i = int(np.searchsorted(times, times[-1] - duration, side='left'))
+        return i - 1 if i > 0 else 0
 
     def _number_data_points_within_duration(self, duration):
-        i = -1
-        time_to_find = self.time[-1] - duration
-        while i > -len(self) and self.time[i] >= time_to_find:
-            i = i - 1
-        return abs(i)
+        return len(self) - self.window_start_index(duration)
 
     def tail_data_by_time_duration(self, duration):
-        return self.tail_data(self._number_data_points_within_duration(duration))
+        return self.data[self.window_start_index(duration):]
 
     def tail_time_by_time_duration(self, duration):
-        return self.tail_time(self._number_data_points_within_duration(duration))
+        return self.time[self.window_start_index(duration):]
 
     def tail_timestamps_by_time_duration(self, duration):
-        return self.tail_timestamps(self._number_data_points_within_duration(duration))
+        return to_datetime64(self.tail_time_by_time_duration(duration), self.time_unit)
 
 
 class DataBuffer(Buffer):
     def __init__(self, filepath: str, name: str, capacity_type: str, capacity: int = DEFAULT_BUFFER_SIZE,
-                 fill_kwargs: dict = None):
+                 fill_kwargs: dict = None, archive_path: str = None, source_type: str = 'file'):
+        # filepath is where the source type reads from: a file or FIFO path, "host:port" for a socket or the name
+        # of a shared memory block
         self.filepath = filepath
-        if fill_kwargs is None:
-            fill_function = time_and_file_reader(filepath)
-        else:
-            fill_function = time_and_file_reader(filepath=filepath, **fill_kwargs)
-        super().__init__(name=name, capacity=capacity, capacity_type=capacity_type, fill_function=fill_function)
-
-
-def system_time():
-    # For ms time TIME_FACTOR should be 1000000
-    return time.time_ns() // TIME_FACTOR
-
-
-def read_n_to_last_line(filename: str, n=1):
-    """Returns the nth before last line of a file (n=1 gives last line)"""
-    """Taken from Jazz Weismann stackoverflow post"""
-    """https://stackoverflow.com/questions/46258499/how-to-read-the-last-line-of-a-file-in-python"""
-    num_newlines = 0
-    with open(filename, 'rb') as f:
-        try:
-            f.seek(-2, os.SEEK_END)
-            while num_newlines < n:
-                f.seek(-2, os.SEEK_CUR)
-                if f.read(1) == b'\n':
-                    num_newlines += 1
-        except OSError:
-            f.seek(0)
-        last_line = f.readline().decode()
-    return last_line
-
-
-def time_and_file_reader(filepath: str, seperator: str = ' ', data_position: int = 0, timestamp_position: int = None):
-    # TODO Implement taking in other formats of time from a file (e.g. formatted time strings)
-    if data_position == timestamp_position:
-        raise ValueError(f'Data and timestamp position of file reader for "{filepath}" are the same.')
-
-    if timestamp_position is None:
-        # No timestamp position given for file reader therefore using system time in ms
-        def time_and_datum():
-            return system_time(), float(read_n_to_last_line(filepath).split(seperator)[data_position].strip())
-    else:
-        def time_and_datum():
-            split_line = read_n_to_last_line(filepath).split(seperator)
-            return float(split_line[timestamp_position]), float(split_line[data_position])
-
-    return time_and_datum
+        self.fill_kwargs = fill_kwargs
+        self.source_type = source_type
+        self.source_kwargs = dict(fill_kwargs or {})
+        if self.source_kwargs.get('timestamp_format'):
+            # Formatted timestamps are converted to epoch times in the unit this buffer holds
+            self.source_kwargs.setdefault('time_unit', time_unit(capacity_type))
+        fill_function = DataSources.create_source(source_type, filepath, **self.source_kwargs)
+        archive = Archive.BufferArchive(archive_path) if archive_path else None
+        super().__init__(name=name, capacity=capacity, capacity_type=capacity_type, fill_function=fill_function,
+                         archive=archive)
+
+    def close(self):
+        # Releases the socket, pipe or shared memory being read so the source can be opened again
+        close = getattr(self.fill_function, 'close', None)
+        if close is not None:
+            close()
+        super().close()
@@ -10,7 +10,8 @@ class Config:
     @classmethod
     def _load_config(cls):
         if cls._config_file is None:
-            cls._config_file = r'config\\config.json'
+            # Resolved next to this module so the tool can be started from any directory (and on any OS)
+            cls._config_file = pathlib.Path(__file__).parent / 'config' / 'config.json'
 
         path = pathlib.Path(cls._config_file)
         if not path.exists():
@@ -23,3 +24,8 @@ class Config:
         if cls._config_lookup is None:
             cls._load_config()
         return cls._config_lookup[key]
+
+    @classmethod
+    def get_path(cls, key) -> pathlib.Path:
+        # Relative paths in the config are relative to the tool's directory, not wherever it was started from
+        return pathlib.Path(__file__).parent / cls.get(key)
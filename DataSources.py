@@ -0,0 +1,711 @@
+import errno
+import os
+import socket
+import sys
+import threading
+import time
+import warnings
+import weakref
+from datetime import datetime, timedelta, timezone
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable
+import numpy as np
+from Config import Config
+
+
+TIME_FACTOR = Config.get('TIME_FACTOR')
+# Blocks with at least this many lines are parsed in one vectorized pass when their layout allows it
+BULK_PARSE_MIN_LINES = 64
+SOCKET_RECEIVE_BYTES = 65536
+# Shared memory ring layout: an int64 count of records ever written and the int64 number of slots, padded to a cache
+# line, followed by the slots of (time, datum) records
+SHARED_MEMORY_HEADER_BYTES = 64
+SHARED_MEMORY_RECORD_DTYPE = np.dtype([('time', '<i8'), ('datum', '<f8')])
+# Delimiters by the names the data source window offers, save files from before the delimiter itself was saved hold
+# the name
+DELIMITERS = {"space": ' ', "comma": ',', "tab": '\t', "pipe": '|', "semi-colon": ';'}
+# timestamp_format for ISO 8601 timestamps, any other format is a strftime format such as '%Y-%m-%d %H:%M:%S.%f'
+ISO_8601 = 'iso8601'
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_UNIT_DELTAS = {'ms': timedelta(milliseconds=1), 'us': timedelta(microseconds=1)}
+_DATE_DIRECTIVE_WIDTHS = {'%Y': 4, '%m': 2, '%d': 2, '%y': 2, '%j': 3, '%b': 3}
+_TIME_DIRECTIVES = ('%H', '%I', '%M', '%S', '%f', '%p')
+# Time of day layouts numpy parses itself once given a date
+_ISO_TIME_FORMATS = ('%H:%M:%S.%f', '%H:%M:%S', '%H:%M')
+# Parsed date prefixes, most streams only ever see a handful
+_date_prefixes: dict[tuple[str, str], np.datetime64] = {}
+_DATE_PREFIX_CACHE_SIZE = 4096
+
+
+def delimiter(seperator: str) -> str:
+    return DELIMITERS.get(seperator, seperator)
+
+
+def system_time():
+    # For ms time TIME_FACTOR should be 1000000
+    return time.time_ns() // TIME_FACTOR
+
+
+def _local_to_epoch(local_times: np.ndarray, unit: str) -> np.ndarray:
+    # UTC offsets only change on the hour, so the offset is looked up once per distinct hour. A time repeated when the
+    # clocks go back is taken as the first of the two, as datetime does.
+    hours, hour_indices = np.unique(local_times.astype('datetime64[h]'), return_inverse=True)
+    offsets = np.array([np.timedelta64(hour.astype(datetime).astimezone().utcoffset()) for hour in hours])
+    return (local_times - offsets.astype(f'timedelta64[{unit}]')[hour_indices.ravel()]).astype(np.int64)
+
+
+def _parse_each(strings: np.ndarray, parse: Callable, unit: str) -> np.ndarray:
+    # One timestamp at a time, for formats numpy can not parse. Times without a UTC offset are local.
+    times = []
+    for string in strings.tolist():
+        parsed = parse(string)
+        times.append(((parsed if parsed.tzinfo else parsed.astimezone()) - _EPOCH) // _UNIT_DELTAS[unit])
+    return np.array(times, dtype=np.int64)
+
+
+def _date_prefix_width(date_format: str) -> int | None:
+    # Characters a date format always produces, None when they vary (e.g. unpadded or spelled out fields)
+    width = 0
+    i = 0
+    while i < len(date_format):
+        if date_format[i] != '%':
+            width += 1
+            i += 1
+            continue
+        directive = date_format[i:i + 2]
+        if directive == '%%':
+            width += 1
+        elif directive in _DATE_DIRECTIVE_WIDTHS:
+            width += _DATE_DIRECTIVE_WIDTHS[directive]
+        else:
+            return None
+        i += 2
+    return width
+
+
+def _parse_date_prefix(prefix: str, date_format: str) -> np.datetime64:
+    key = (date_format, prefix)
+    day = _date_prefixes.get(key)
+    if day is None:
+        if len(_date_prefixes) >= _DATE_PREFIX_CACHE_SIZE:
+            _date_prefixes.clear()
+        day = np.datetime64(datetime.strptime(prefix, date_format).date(), 'D')
+        _date_prefixes[key] = day
+    return day
+
+
+def parse_timestamps(strings, timestamp_format: str, unit: str = 'ms') -> np.ndarray:
+    """Epoch times in unit ('ms' or 'us') from formatted timestamps, either ISO 8601 or a strftime format. Times
+    without a UTC offset are local wall clock times. Raises ValueError if any timestamp does not match the format.
+
+    Timestamps numpy understands are parsed as datetime64 in one pass. For a strftime format whose date part has a
+    fixed width and whose time of day is laid out as in ISO 8601, each distinct date prefix is parsed once (and kept
+    between calls) and only the time of day is parsed per timestamp, again by numpy. Other formats are parsed one
+    timestamp at a time.
+    """
+    strings = np.asarray(strings)
+    if strings.dtype.kind != 'U':
+        strings = strings.astype(str)
+    if strings.size == 0:
+        return np.empty(0, dtype=np.int64)
+    dtype = f'datetime64[{unit}]'
+
+    if timestamp_format == ISO_8601:
+        with warnings.catch_warnings():
+            # numpy only warns about UTC offsets, those timestamps are left to datetime
+            warnings.simplefilter('error')
+            try:
+                return _local_to_epoch(strings.astype(dtype), unit)
+            except (ValueError, UserWarning):
+                return _parse_each(strings, datetime.fromisoformat, unit)
+
+    def _strptime(string):
+        return datetime.strptime(string, timestamp_format)
+
+    time_start = min((i for i in (timestamp_format.find(d) for d in _TIME_DIRECTIVES) if i >= 0),
+                     default=len(timestamp_format))
+    date_format, time_format = timestamp_format[:time_start], timestamp_format[time_start:]
+    width = _date_prefix_width(date_format)
+    if width is None or time_format not in _ISO_TIME_FORMATS:
+        return _parse_each(strings, _strptime, unit)
+
+    prefixes, prefix_indices = np.unique(strings.astype(f'U{width}'), return_inverse=True)
+    length = strings.dtype.itemsize // 4
+    characters = np.ascontiguousarray(strings).view('U1').reshape(strings.size, length)
+    times_of_day = np.ascontiguousarray(characters[:, width:]).view(f'U{max(length - width, 1)}').ravel()
+    try:
+        # Dates that are not the expected width (e.g. unpadded days) leave the date or time unparseable
+        days = np.array([_parse_date_prefix(prefix, date_format) for prefix in prefixes.tolist()])
+        since_midnight = np.char.add('1970-01-01T', times_of_day).astype(dtype) - np.datetime64(0, unit)
+    except ValueError:
+        return _parse_each(strings, _strptime, unit)
+    return _local_to_epoch(days[prefix_indices.ravel()].astype(dtype) + since_midnight, unit)
+
+
+def _timestamp_field_count(timestamp_format: str | None, byte_seperator: bytes) -> int:
+    # Separated fields a timestamp spans, e.g. two for '%Y-%m-%d %H:%M:%S' in a space delimited line
+    if timestamp_format is None or timestamp_format == ISO_8601:
+        return 1
+    return timestamp_format.count(byte_seperator.decode()) + 1
+
+
+def parse_columns(lines: list[bytes], byte_seperator: bytes = b' ', data_positions: tuple = (0,),
+                  timestamp_position: int = None, timestamp_format: str = None,
+                  time_unit: str = 'ms') -> tuple[np.ndarray, np.ndarray]:
+    """Times and a (lines, len(data_positions)) array of values, each line split once however many columns are read"""
+    timestamp_fields = _timestamp_field_count(timestamp_format, byte_seperator)
+    times = []
+    rows = []
+    for line in lines:
+        split_line = line.split(byte_seperator)
+        try:
+            row = [float(split_line[position]) for position in data_positions]
+            if timestamp_position is not None and timestamp_format is None:
+                times.append(float(split_line[timestamp_position]))
+            elif timestamp_position is not None:
+                fields = split_line[timestamp_position:timestamp_position + timestamp_fields]
+                if len(fields) < timestamp_fields:
+                    continue
+                times.append(byte_seperator.join(fields).decode(errors='replace'))
+        except (IndexError, ValueError):
+            # Skip malformed lines rather than stalling the stream
+            continue
+        rows.append(row)
+
+    if timestamp_position is None:
+        # No timestamp position given therefore using system time in ms
+        times = [system_time()] * len(rows)
+    elif timestamp_format is not None:
+        try:
+            times = parse_timestamps(times, timestamp_format, time_unit)
+        except ValueError:
+            # Find the lines whose timestamps do not match and skip them too
+            valid = [i for i, string in enumerate(times) if _matches_format(string, timestamp_format, time_unit)]
+            times = parse_timestamps([times[i] for i in valid], timestamp_format, time_unit)
+            rows = [rows[i] for i in valid]
+    values = np.array(rows, dtype=np.float64).reshape(len(rows), len(data_positions))
+    return np.array(times, dtype=np.int64), values
+
+
+def _matches_format(string: str, timestamp_format: str, time_unit: str) -> bool:
+    try:
+        parse_timestamps([string], timestamp_format, time_unit)
+    except ValueError:
+        return False
+    return True
+
+
+def parse_lines(lines: list[bytes], byte_seperator: bytes = b' ', data_position: int = 0,
+                timestamp_position: int = None, timestamp_format: str = None,
+                time_unit: str = 'ms') -> tuple[np.ndarray, np.ndarray]:
+    times, values = parse_columns(lines, byte_seperator, (data_position,), timestamp_position, timestamp_format,
+                                  time_unit)
+    return times, values[:, 0]
+
+
+def _parse_uniform_block(block: bytes, byte_seperator: bytes, data_positions: tuple,
+                         timestamp_position: int = None, timestamp_format: str = None, time_unit: str = 'ms'):
+    """Vectorized parse of a block of lines that all hold the same number of numeric columns separated by a single
+    byte, apart from a formatted timestamp of the same width on every line. Returns None when the block does not have
+    that layout so it can be parsed line by line instead."""
+    if len(byte_seperator) != 1:
+        return None
+    if b'\r' in block:
+        block = block.replace(b'\r', b'')
+    block = block.rstrip(b'\n')
+    if not block:
+        return None
+    raw = np.frombuffer(block, dtype=np.uint8)
+    line_ends = np.flatnonzero(raw == ord('\n'))
+    seperators = np.flatnonzero(raw == byte_seperator[0])
+    # Number of separators on each line, every line must have the same
+    seperator_counts = np.diff(np.searchsorted(seperators, line_ends), prepend=0, append=seperators.size)
+    column_count = int(seperator_counts[0]) + 1
+    if np.any(seperator_counts != column_count - 1):
+        return None
+    timestamp_fields = _timestamp_field_count(timestamp_format, byte_seperator)
+    positions = tuple(data_positions) + (() if timestamp_position is None else
+                                         (timestamp_position + timestamp_fields - 1,))
+    if max(positions) >= column_count:
+        return None
+    line_count = line_ends.size + 1
+
+    if timestamp_format is not None and timestamp_position is not None:
+        last_field = timestamp_position + timestamp_fields - 1
+        if any(timestamp_position < position <= last_field for position in data_positions):
+            return None
+        # Cut the timestamps out by position, they have to be the same width on every line
+        field_ends = seperators.reshape(line_count, column_count - 1)
+        if timestamp_position == 0:
+            starts = np.concatenate(([0], line_ends + 1))
+        else:
+            starts = field_ends[:, timestamp_position - 1] + 1
+        stops = np.append(line_ends, raw.size) if last_field == column_count - 1 else field_ends[:, last_field]
+        width = int(stops[0] - starts[0])
+        if width == 0 or np.any(stops - starts != width):
+            return None
+        characters = starts[:, None] + np.arange(width)
+        try:
+            times = parse_timestamps(raw[characters].view(f'S{width}').ravel(), timestamp_format, time_unit)
+        except ValueError:
+            return None
+        # Then stand a single number in for each timestamp so the rest of the line parses as before
+        raw = raw.copy()
+        raw[characters] = ord(' ')
+        raw[starts] = ord('0')
+        block = raw.tobytes()
+        column_count -= timestamp_fields - 1
+        data_positions = tuple(position - (timestamp_fields - 1) if position > last_field else position
+                               for position in data_positions)
+
+    text = block if byte_seperator == b' ' else block.replace(byte_seperator, b' ')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        try:
+            values = np.fromstring(text, dtype=np.float64, sep=' ')
+        except ValueError:
+            # A field that is not a number
+            return None
+    if values.size != line_count * column_count:
+        return None
+    table = values.reshape(line_count, column_count)
+
+    if timestamp_position is None:
+        times = np.full(line_count, system_time(), dtype=np.int64)
+    elif timestamp_format is None:
+        times = table[:, timestamp_position].astype(np.int64)
+    return times, table[:, list(data_positions)]
+
+
+def parse_block(block: bytes, byte_seperator: bytes = b' ', data_positions: tuple = (0,),
+                timestamp_position: int = None, timestamp_format: str = None,
+                time_unit: str = 'ms') -> tuple[np.ndarray, np.ndarray]:
+    """Times and a (lines, len(data_positions)) array of values from a block of complete lines. Large blocks are
+    parsed in one vectorized pass, anything with malformed lines falls back to parsing line by line.
+
+    Without a timestamp_format the timestamp column holds epoch times, otherwise it is parsed with parse_timestamps
+    into time_unit. A formatted timestamp containing the delimiter spans several columns starting at
+    timestamp_position, and data positions count those columns."""
+    if block.count(b'\n') >= BULK_PARSE_MIN_LINES:
+        parsed = _parse_uniform_block(block, byte_seperator, data_positions, timestamp_position, timestamp_format,
+                                      time_unit)
+        if parsed is not None:
+            return parsed
+    lines = [line.rstrip(b'\r') for line in block.split(b'\n') if line.strip()]
+    return parse_columns(lines, byte_seperator, data_positions, timestamp_position, timestamp_format, time_unit)
+
+
+def split_lines(partial_line: bytes, chunk: bytes) -> tuple[list[bytes], bytes]:
+    # Complete, non-blank lines in the chunk and whatever follows the final newline (a line still being written)
+    lines = (partial_line + chunk).split(b'\n')
+    partial_line = lines.pop()
+    return [line.rstrip(b'\r') for line in lines if line.strip()], partial_line
+
+
+def _check_positions(location: str, data_position: int, timestamp_position: int, timestamp_format: str = None):
+    if data_position == timestamp_position:
+        raise ValueError(f'Data and timestamp position of reader for "{location}" are the same.')
+    if timestamp_format is not None and timestamp_position is None:
+        raise ValueError(f'Reader for "{location}" has a timestamp format but no timestamp position.')
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(':')
+    if not port.isnumeric():
+        raise ValueError(f'Socket address "{address}" must be given as host:port')
+    return host or '127.0.0.1', int(port)
+
+
+class FileFollower:
+    """Tails a file by byte offset, returning every complete line appended since the previous read"""
+    def __init__(self, filepath: str, start_at_end: bool = True):
+        self.filepath = filepath
+        self.start_at_end = start_at_end
+        self._offset = None
+        self._file_id = None
+        self._partial_line = b''
+        self._skip_to_newline = False
+
+    def _reset(self, offset: int = 0):
+        self._offset = offset
+        self._partial_line = b''
+        self._skip_to_newline = False
+
+    def _start_at_end(self, size: int):
+        self._reset(size)
+        if size:
+            # Starting partway through a line would read the rest of it as a line of its own, skip to the next one
+            with open(self.filepath, 'rb') as f:
+                f.seek(size - 1)
+                self._skip_to_newline = f.read(1) != b'\n'
+
+    def read_new_block(self) -> bytes:
+        """Every complete line appended since the previous read, as one block of bytes"""
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            return b''
+
+        file_id = (stat.st_dev, stat.st_ino)
+        if self._offset is None:
+            if self.start_at_end:
+                self._start_at_end(stat.st_size)
+            else:
+                self._reset()
+        elif file_id != self._file_id or stat.st_size < self._offset:
+            # The file was rotated (replaced by a new file) or truncated in place; start over from its beginning
+            self._reset()
+        self._file_id = file_id
+
+        if stat.st_size == self._offset:
+            return b''
+
+        with open(self.filepath, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        self._offset += len(chunk)
+
+        # Anything after the final newline is a line still being written, keep it for the next read
+        block = self._partial_line + chunk
+        if self._skip_to_newline:
+            line_end = block.find(b'\n')
+            if line_end < 0:
+                self._partial_line = b''
+                return b''
+            block = block[line_end + 1:]
+            self._skip_to_newline = False
+        end = block.rfind(b'\n') + 1
+        self._partial_line = block[end:]
+        return block[:end]
+
+    def read_new_lines(self) -> list[bytes]:
+        return [line.rstrip(b'\r') for line in self.read_new_block().split(b'\n') if line.strip()]
+
+
+def time_and_file_reader(filepath: str, seperator: str = ' ', data_position: int = 0, timestamp_position: int = None,
+                         start_at_end: bool = True, timestamp_format: str = None, time_unit: str = 'ms'):
+    _check_positions(filepath, data_position, timestamp_position, timestamp_format)
+    follower = FileFollower(filepath, start_at_end=start_at_end)
+    byte_seperator = seperator.encode()
+
+    def times_and_data():
+        times, values = parse_block(follower.read_new_block(), byte_seperator, (data_position,), timestamp_position,
+                                    timestamp_format, time_unit)
+        return times, values[:, 0]
+
+    return times_and_data
+
+
+class LineSource:
+    """Base for sources delivering text lines in the same layout as a data file. Calling the source drains whatever
+    has arrived since the last call without blocking."""
+    def __init__(self, location: str, seperator: str = ' ', data_position: int = 0, timestamp_position: int = None,
+                 timestamp_format: str = None, time_unit: str = 'ms'):
+        _check_positions(location, data_position, timestamp_position, timestamp_format)
+        self.location = location
+        self.byte_seperator = seperator.encode()
+        self.data_position = data_position
+        self.timestamp_position = timestamp_position
+        self.timestamp_format = timestamp_format
+        self.time_unit = time_unit
+
+    def read_new_lines(self) -> list[bytes]:
+        raise NotImplementedError
+
+    def read_new_block(self) -> bytes:
+        return b'\n'.join(self.read_new_lines())
+
+    def close(self):
+        pass
+
+    def __call__(self) -> tuple[np.ndarray, np.ndarray]:
+        times, values = parse_block(self.read_new_block(), self.byte_seperator, (self.data_position,),
+                                    self.timestamp_position, self.timestamp_format, self.time_unit)
+        return times, values[:, 0]
+
+
+class UdpSource(LineSource):
+    """Listens for datagrams on host:port, each holding one or more lines"""
+    def __init__(self, address: str, **kwargs):
+        super().__init__(address, **kwargs)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(parse_address(address))
+        self.socket.setblocking(False)
+
+    def read_new_lines(self) -> list[bytes]:
+        lines = []
+        while True:
+            try:
+                datagram = self.socket.recv(SOCKET_RECEIVE_BYTES)
+            except BlockingIOError:
+                return lines
+            lines += [line.rstrip(b'\r') for line in datagram.split(b'\n') if line.strip()]
+
+    def close(self):
+        self.socket.close()
+
+
+class TcpSource(LineSource):
+    """Listens on host:port and reads newline separated lines from every producer that connects"""
+    def __init__(self, address: str, **kwargs):
+        super().__init__(address, **kwargs)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(parse_address(address))
+        self.socket.listen()
+        self.socket.setblocking(False)
+        self._connections: dict[socket.socket, bytes] = {}
+
+    def _accept_new_connections(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except BlockingIOError:
+                return
+            connection.setblocking(False)
+            self._connections[connection] = b''
+
+    def read_new_lines(self) -> list[bytes]:
+        self._accept_new_connections()
+        lines = []
+        for connection in list(self._connections):
+            while True:
+                try:
+                    chunk = connection.recv(SOCKET_RECEIVE_BYTES)
+                except BlockingIOError:
+                    break
+                except ConnectionError:
+                    chunk = b''
+                if not chunk:
+                    # The producer disconnected
+                    connection.close()
+                    del self._connections[connection]
+                    break
+                new_lines, self._connections[connection] = split_lines(self._connections[connection], chunk)
+                lines += new_lines
+        return lines
+
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+        self._connections.clear()
+        self.socket.close()
+
+
+class FifoSource(LineSource):
+    """Reads lines from a named pipe (created if missing), opened non-blocking so no producer needs to be attached"""
+    def __init__(self, path: str, **kwargs):
+        super().__init__(path, **kwargs)
+        if not os.path.exists(path):
+            os.mkfifo(path)
+        self._fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        self._partial_line = b''
+
+    def read_new_lines(self) -> list[bytes]:
+        chunks = []
+        while True:
+            try:
+                chunk = os.read(self._fd, SOCKET_RECEIVE_BYTES)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                break
+            if not chunk:
+                # No producer has the pipe open
+                break
+            chunks.append(chunk)
+        lines, self._partial_line = split_lines(self._partial_line, b''.join(chunks))
+        return lines
+
+    def close(self):
+        os.close(self._fd)
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Opens shared memory created by another process without this process's resource tracker taking it over. Before
+    Python 3.13 attaching registers the memory with the tracker, which unlinks it when this process exits."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    memory = shared_memory.SharedMemory(name=name)
+    if os.name == 'posix':
+        resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+
+def _ring_views(memory: shared_memory.SharedMemory) -> tuple[np.ndarray, np.ndarray]:
+    header = np.ndarray((2,), dtype=np.int64, buffer=memory.buf)
+    records = np.ndarray((int(header[1]),), dtype=SHARED_MEMORY_RECORD_DTYPE, buffer=memory.buf,
+                         offset=SHARED_MEMORY_HEADER_BYTES)
+    return header, records
+
+
+class SharedMemoryRingWriter:
+    """Producer side of a shared memory ring: appends (time, datum) records, overwriting the oldest once full"""
+    def __init__(self, name: str, slots: int = 65536, create: bool = True):
+        size = SHARED_MEMORY_HEADER_BYTES + slots * SHARED_MEMORY_RECORD_DTYPE.itemsize
+        if create:
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.memory = attach_shared_memory(name)
+        if create:
+            np.ndarray((2,), dtype=np.int64, buffer=self.memory.buf)[:] = (0, slots)
+        self._header, self._records = _ring_views(self.memory)
+
+    def write(self, times, data):
+        times = np.atleast_1d(np.asarray(times, dtype=np.int64))
+        data = np.atleast_1d(np.asarray(data, dtype=np.float64))
+        slots = self._records.size
+        if times.size > slots:
+            times, data = times[-slots:], data[-slots:]
+        written = int(self._header[0])
+        positions = (written + np.arange(times.size)) % slots
+        self._records['time'][positions] = times
+        self._records['datum'][positions] = data
+        # Published only once the records are in place
+        self._header[0] = written + times.size
+
+    def close(self, unlink: bool = False):
+        del self._header, self._records
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class SharedMemoryRingSource:
+    """Consumer side of a shared memory ring written by SharedMemoryRingWriter. Each call returns every record
+    written since the previous call; if the producer has lapped the reader the overwritten records are skipped."""
+    def __init__(self, name: str):
+        self.location = name
+        self.memory = attach_shared_memory(name)
+        self._header, self._records = _ring_views(self.memory)
+        self._read = int(self._header[0])
+
+    def __call__(self) -> tuple[np.ndarray, np.ndarray]:
+        slots = self._records.size
+        written = int(self._header[0])
+        start = max(self._read, written - slots)
+        positions = np.arange(start, written) % slots
+        records = self._records[positions]
+        # Anything the producer overwrote while the records were being copied is dropped
+        lapped = max(int(self._header[0]) - slots - start, 0)
+        self._read = written
+        return records['time'][lapped:], records['datum'][lapped:]
+
+    def close(self):
+        del self._header, self._records
+        self.memory.close()
+
+
+class MultiChannelReader:
+    """Reads a line source once per refresh and fans the columns out to any number of channels, one per buffer.
+
+    Each line is split once for every channel together. The reader only holds its channels weakly, so a column stops
+    being parsed once the buffer reading it is gone.
+    """
+    def __init__(self, read_new_block: Callable, location: str, seperator: str = ' ', timestamp_position: int = None,
+                 timestamp_format: str = None, time_unit: str = 'ms', close_source: Callable = None):
+        self.read_new_block = read_new_block
+        self.close_source = close_source
+        self.closed = False
+        self.location = location
+        self.byte_seperator = seperator.encode()
+        self.timestamp_position = timestamp_position
+        self.timestamp_format = timestamp_format
+        self.time_unit = time_unit
+        self._channels = weakref.WeakSet()
+        # Charts on different worker threads may share a reader
+        self._lock = threading.Lock()
+
+    def channel(self, data_position: int = 0) -> 'ReaderChannel':
+        _check_positions(self.location, data_position, self.timestamp_position, self.timestamp_format)
+        channel = ReaderChannel(self, data_position)
+        with self._lock:
+            self._channels.add(channel)
+        return channel
+
+    def _poll(self):
+        # Called with the lock held
+        block = self.read_new_block()
+        if not block:
+            return
+        channels = list(self._channels)
+        positions = sorted({channel.data_position for channel in channels})
+        times, values = parse_block(block, self.byte_seperator, tuple(positions), self.timestamp_position,
+                                    self.timestamp_format, self.time_unit)
+        for channel in channels:
+            channel.pending.append((times, values[:, positions.index(channel.data_position)]))
+
+    def remove_channel(self, channel: 'ReaderChannel'):
+        # The source is closed along with the last channel reading it
+        with self._lock:
+            self._channels.discard(channel)
+            if self._channels or self.closed:
+                return
+            self.closed = True
+            if self.close_source is not None:
+                self.close_source()
+
+
+class ReaderChannel:
+    """Fill function for one column of a MultiChannelReader"""
+    def __init__(self, reader: MultiChannelReader, data_position: int):
+        self.reader = reader
+        self.data_position = data_position
+        self.pending = []
+
+    def __call__(self) -> tuple[np.ndarray, np.ndarray]:
+        with self.reader._lock:
+            self.reader._poll()
+            pending, self.pending = self.pending, []
+        if not pending:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return np.concatenate([times for times, _ in pending]), np.concatenate([data for _, data in pending])
+
+    def close(self):
+        self.reader.remove_channel(self)
+
+
+SOURCE_TYPES = {'file': time_and_file_reader,
+                'udp': UdpSource,
+                'tcp': TcpSource,
+                'fifo': FifoSource,
+                'shared_memory': SharedMemoryRingSource}
+
+# Readers shared between buffers, dropped once every buffer reading through one has gone
+_shared_readers: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+_shared_readers_lock = threading.Lock()
+
+
+def _shared_reader(source_type: str, location: str, seperator: str = ' ', timestamp_position: int = None,
+                   start_at_end: bool = True, timestamp_format: str = None, time_unit: str = 'ms') -> MultiChannelReader:
+    key = (source_type, location, seperator, timestamp_position, timestamp_format, time_unit)
+    with _shared_readers_lock:
+        reader = _shared_readers.get(key)
+        if reader is None or reader.closed:
+            if source_type == 'file':
+                read_new_block = FileFollower(location, start_at_end=start_at_end).read_new_block
+                close_source = None
+            elif source_type in ('udp', 'tcp', 'fifo'):
+                # Only the transport of the line source is used, the reader does the parsing
+                transport = SOURCE_TYPES[source_type](location)
+                read_new_block, close_source = transport.read_new_block, transport.close
+            else:
+                raise ValueError(f'Data source type "{source_type}" does not deliver lines and can not be shared')
+            reader = MultiChannelReader(read_new_block, location, seperator=seperator,
+                                        timestamp_position=timestamp_position, timestamp_format=timestamp_format,
+                                        time_unit=time_unit, close_source=close_source)
+            _shared_readers[key] = reader
+        return reader
+
+
+def create_source(source_type: str, location: str, shared_reader: bool = False, **kwargs):
+    """A fill function for a Buffer that reads from the given kind of source. With shared_reader, every buffer reading
+    the same source (and line layout) shares one reader, each taking its own data_position column from it."""
+    if source_type not in SOURCE_TYPES:
+        raise ValueError(f'Data source type "{source_type}" is not recognized, must be one of {list(SOURCE_TYPES)}')
+    if shared_reader:
+        data_position = kwargs.pop('data_position', 0)
+        return _shared_reader(source_type, location, **kwargs).channel(data_position)
+    return SOURCE_TYPES[source_type](location, **kwargs)
@@ -0,0 +1,274 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import State
+from Config import Config
+
+
+INGESTION_PERIOD_MS = Config.get('INGESTION_PERIOD_MS')
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionEngine:
+    """Runs ingestion, statistics and triggers for a State on a background thread, independent of any plotting"""
+    def __init__(self, state: State.State, period_ms: float = INGESTION_PERIOD_MS):
+        self.state = state
+        self.period_ms = period_ms
+        # Held while the state is being updated; anything else touching the state from another thread must take it
+        self.lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # The exception that stopped ingestion, if any, cleared when the engine is started again
+        self.error: Exception | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop_event.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name='IngestionEngine', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def step(self):
+        with self.lock:
+            return self.state.process_next_frame()
+
+    def snapshot(self) -> State.StateSnapshot:
+        with self.lock:
+            return self.state.snapshot()
+
+    def _run(self):
+        period = self.period_ms / 1000.0
+        next_tick = time.perf_counter()
+        while not self._stop_event.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                # A failing source or trigger stops ingestion, the error is kept for whatever is watching the engine
+                self.error = e
+                logger.exception('Ingestion stopped by an error')
+                return
+            next_tick += period
+            delay = next_tick - time.perf_counter()
+            if delay < 0:
+                # Fell behind (e.g. a large backlog in the source), carry on from now rather than bursting to catch up
+                next_tick = time.perf_counter()
+                delay = 0
+            self._stop_event.wait(delay)
+
+
+@dataclass
+class ChartStats:
+    frames: int = 0
+    points: int = 0
+    cpu_seconds: float = 0.0
+    error: str | None = None  # Set when the chart stopped because of an exception, it is not scheduled again
+
+
+class MultiChartEngine:
+    """Hosts many charts (each a State with its own lock, see IngestionEngine) on one scheduling loop.
+
+    Every period each chart whose previous frame has finished is handed to a worker pool, so a slow chart only
+    delays itself. CPU time spent processing each chart is accumulated in its ChartStats. A chart whose frame raises
+    is logged and taken out of the schedule, and the loop ends once every chart has stopped.
+
+    The workers are threads, so charts only run in parallel while in NumPy. Statistics and triggers with per point
+    Python loops (order statistics, the streaming trigger rules, line by line parsing) hold the GIL; to spread those
+    over cores use ProcessChartEngine.
+    """
+    def __init__(self, period_ms: float = INGESTION_PERIOD_MS, max_workers: int = None):
+        self.period_ms = period_ms
+        self.max_workers = max_workers or os.cpu_count()
+        self.charts: dict[str, IngestionEngine] = {}
+        self.stats: dict[str, ChartStats] = {}
+        self._charts_lock = threading.Lock()
+        self._in_flight = set()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def add_chart(self, name: str, state: State.State) -> IngestionEngine:
+        with self._charts_lock:
+            if name in self.charts:
+                raise ValueError(f'A chart named "{name}" is already running')
+            chart = IngestionEngine(state, period_ms=self.period_ms)
+            self.charts[name] = chart
+            self.stats[name] = ChartStats()
+        return chart
+
+    def add_save_file(self, save_file: str, name: str = None) -> IngestionEngine:
+        state = State.State()
+        state.open_save_file(save_file)
+        state.populate_state_from_reference()
+        return self.add_chart(name if name is not None else save_file, state)
+
+    def remove_chart(self, name: str):
+        with self._charts_lock:
+            chart = self.charts.pop(name)
+            self.stats.pop(name)
+        # Wait out a frame that may still be in progress on a worker
+        with chart.lock:
+            pass
+
+    def start(self):
+        if self.running:
+            return
+        self._stop_event.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='MultiChartEngine')
+        self._thread = threading.Thread(target=self._run, name='MultiChartEngine', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _step_chart(self, name: str, chart: IngestionEngine):
+        try:
+            cpu_start = time.thread_time()
+            points = chart.step()
+            cpu_seconds = time.thread_time() - cpu_start
+            with self._charts_lock:
+                stats = self.stats.get(name)
+                if stats is not None:
+                    stats.frames += 1 if points else 0
+                    stats.points += points
+                    stats.cpu_seconds += cpu_seconds
+        except Exception as e:
+            logger.exception('Chart "%s" stopped by an error', name)
+            with self._charts_lock:
+                stats = self.stats.get(name)
+                if stats is not None:
+                    stats.error = f'{type(e).__name__}: {e}'
+        finally:
+            with self._charts_lock:
+                self._in_flight.discard(name)
+
+    @property
+    def failed(self) -> bool:
+        # Every chart has stopped with an error
+        with self._charts_lock:
+            return bool(self.stats) and all(stats.error is not None for stats in self.stats.values())
+
+    def step(self):
+        # Schedule every chart that is not still busy with its previous frame or stopped by an error
+        with self._charts_lock:
+            ready = [(name, chart) for name, chart in self.charts.items()
+                     if name not in self._in_flight and self.stats[name].error is None]
+            self._in_flight.update(name for name, _ in ready)
+        for name, chart in ready:
+            self._executor.submit(self._step_chart, name, chart)
+
+    def _run(self):
+        period = self.period_ms / 1000.0
+        next_tick = time.perf_counter()
+        while not self._stop_event.is_set() and not self.failed:
+            self.step()
+            next_tick += period
+            delay = next_tick - time.perf_counter()
+            if delay < 0:
+                next_tick = time.perf_counter()
+                delay = 0
+            self._stop_event.wait(delay)
+
+
+def _run_chart_process(charts: list[tuple[str, str]], period_ms: float, stop_event, results):
+    # Runs in a worker process of ProcessChartEngine, sending back the charts' stats when it finishes
+    engine = MultiChartEngine(period_ms=period_ms, max_workers=1)
+    not_started = {}
+    try:
+        for name, save_file in charts:
+            try:
+                engine.add_save_file(save_file, name)
+            except Exception as e:
+                logger.exception('Chart "%s" could not be started', name)
+                not_started[name] = ChartStats(error=f'{type(e).__name__}: {e}')
+        if engine.charts:
+            engine.start()
+            while engine.running and not stop_event.wait(0.5):
+                pass
+    finally:
+        engine.stop()
+        results.put(engine.stats | not_started)
+
+
+class ProcessChartEngine:
+    """Runs charts given as save files spread over worker processes, each process hosting its share of the charts
+    on a MultiChartEngine. Charts run in parallel whatever their statistics and triggers do, but each process reads
+    its own data sources and ChartStats only arrive once the processes stop."""
+    def __init__(self, period_ms: float = INGESTION_PERIOD_MS, max_workers: int = None):
+        self.period_ms = period_ms
+        self.max_workers = max_workers or os.cpu_count()
+        self.save_files: dict[str, str] = {}
+        self.stats: dict[str, ChartStats] = {}
+        self._processes = []
+        self._stop_event = multiprocessing.Event()
+        self._results = multiprocessing.Queue()
+
+    @property
+    def running(self) -> bool:
+        return any(process.is_alive() for process in self._processes)
+
+    def add_save_file(self, save_file: str, name: str = None):
+        if self._processes:
+            raise ValueError('Charts can not be added once the engine has started')
+        name = name if name is not None else save_file
+        if name in self.save_files:
+            raise ValueError(f'A chart named "{name}" is already running')
+        # Only checked here, the data source is opened by the worker process
+        State.State().open_save_file(save_file)
+        self.save_files[name] = save_file
+
+    def start(self):
+        if self._processes:
+            return
+        self._stop_event.clear()
+        charts = list(self.save_files.items())
+        for worker in range(min(self.max_workers, len(charts))):
+            process = multiprocessing.Process(target=_run_chart_process, name=f'ProcessChartEngine-{worker}',
+                                              args=(charts[worker::self.max_workers], self.period_ms, self._stop_event,
+                                                    self._results), daemon=True)
+            process.start()
+            self._processes.append(process)
+
+    def stop(self, timeout: float = None):
+        self._stop_event.set()
+        # The results are read before joining, a process does not exit until what it queued has been taken
+        pending = len(self._processes)
+        while pending:
+            try:
+                self.stats.update(self._results.get(timeout=0.1))
+                pending -= 1
+            except queue.Empty:
+                if not self.running and self._results.empty():
+                    # A process that died without reporting
+                    break
+        for process in self._processes:
+            process.join(timeout)
+            if process.exitcode not in (0, None):
+                logger.error('Chart process %s exited with code %s', process.name, process.exitcode)
+        self._processes = []
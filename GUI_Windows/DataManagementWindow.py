@@ -3,6 +3,10 @@ import customtkinter as ctk
 from tkinter import filedialog, messagebox
 import pathlib
 import os
+import DataSources
+
+SOURCE_TYPE_NAMES = {"File": 'file', "UDP socket": 'udp', "TCP socket": 'tcp', "Named pipe (FIFO)": 'fifo',
+                     "Shared memory ring": 'shared_memory'}
 
 
 class FilePathFrame(ctk.CTkFrame):
@@ -17,14 +21,23 @@ class FilePathFrame(ctk.CTkFrame):
             self.file_name_entry_default_text = "Target Data File Path"
         else:
             self.file_name_entry_default_text = self.root_app.data_state.data_source.filepath
-        self.title_label = ctk.CTkLabel(self, text="Data File Path (Required)", fg_color="gray30", corner_radius=6)
+        self.title_label = ctk.CTkLabel(self, text="Data Source (Required): file or pipe path, host:port for a "
+                                                   "socket or the shared memory name", fg_color="gray30",
+                                        corner_radius=6)
         self.title_label.grid(row=0, column=0, padx=5, pady=(10, 0), sticky="ew", columnspan=2)
 
+        self.source_type_combo_box = ctk.CTkComboBox(self, values=list(SOURCE_TYPE_NAMES))
+        self.source_type_combo_box.grid(row=1, column=0, sticky='w', padx=5, pady=(10, 0))
+        if self.root_app.data_state.data_source is not None:
+            current_type = self.root_app.data_state.data_source.source_type
+            self.source_type_combo_box.set(next(name for name, source_type in SOURCE_TYPE_NAMES.items()
+                                                if source_type == current_type))
+
         self.file_name_entry = ctk.CTkEntry(self, placeholder_text=self.file_name_entry_default_text)
-        self.file_name_entry.grid(row=1, column=0, sticky='ew', padx=5, pady=20)
+        self.file_name_entry.grid(row=2, column=0, sticky='ew', padx=5, pady=20)
 
         self.file_name_browse_button = ctk.CTkButton(self, text="Browse", command=self.file_name_browser)
-        self.file_name_browse_button.grid(row=1, column=1, sticky='e', padx=5, pady=20)
+        self.file_name_browse_button.grid(row=2, column=1, sticky='e', padx=5, pady=20)
 
     def file_name_browser(self):
         f = filedialog.askopenfilename(initialdir=os.getcwd(), title="Select data file",
@@ -53,7 +66,7 @@ class FileStructureFrame(ctk.CTkFrame):
         self.delimiter_combo_box_label = ctk.CTkLabel(self.delimiter_frame, text="Delimiter:")
         self.delimiter_combo_box_label.grid(row=0, column=0, padx=10, pady=(10, 0), sticky='ew')
         self.delimiter_combo_box = ctk.CTkComboBox(self.delimiter_frame,
-                                                   values=["space", "comma", "tab", "pipe", "semi-colon"])
+                                                   values=list(DataSources.DELIMITERS))
         self.delimiter_combo_box.grid(row=1, column=0, padx=10, pady=(5, 0), sticky='ew')
         self.delimiter_frame.grid(row=1, column=0, padx=5, pady=(5, 10))
 
@@ -121,12 +134,25 @@ class DataManagementWindow(ctk.CTkToplevel):
         info_messages = []
         error_messages = []
 
+        source_type = SOURCE_TYPE_NAMES.get(self.file_path_frame.source_type_combo_box.get(), 'file')
+        new_config = new_config | {'source_type': source_type}
         new_file_path = self.file_path_frame.file_name_entry.get()
-        if new_file_path is not None and pathlib.Path(new_file_path).exists():
-            new_file_path = str(pathlib.Path(new_file_path).resolve())
+        if source_type == 'file':
+            if new_file_path is not None and pathlib.Path(new_file_path).exists():
+                new_file_path = str(pathlib.Path(new_file_path).resolve())
+                new_config = new_config | {'filepath': new_file_path}
+            else:
+                error_messages.append('Filepath not valid or not provided. A valid filepath must be provided')
+        elif source_type in ('udp', 'tcp'):
+            try:
+                DataSources.parse_address(new_file_path)
+                new_config = new_config | {'filepath': new_file_path}
+            except ValueError:
+                error_messages.append('Socket address not valid. It must be given as host:port')
+        elif new_file_path:
             new_config = new_config | {'filepath': new_file_path}
         else:
-            error_messages.append('Filepath not valid or not provided. A valid filepath must be provided')
+            error_messages.append('A pipe path or shared memory name must be provided')
 
         new_capacity = self.data_capacity_frame.capacity_entry.get()
         if new_capacity is not None and new_capacity and str(new_capacity).isnumeric():
@@ -137,8 +163,8 @@ class DataManagementWindow(ctk.CTkToplevel):
             new_config = new_config | {'capacity': 60000}
 
         new_delimiter = self.data_file_structure_frame.delimiter_combo_box.get()
-        if new_delimiter and new_delimiter in ("space", "comma", "tab", "pipe", "semi-colon"):
-            new_config = new_config | {'seperator': new_delimiter}
+        if new_delimiter and new_delimiter in DataSources.DELIMITERS:
+            new_config = new_config | {'seperator': DataSources.DELIMITERS[new_delimiter]}
         else:
             info_messages.append('File delimiter invalid or not provided; using default value of a space.')
             new_config = new_config | {'seperator': ' '}
@@ -155,7 +181,12 @@ class DataManagementWindow(ctk.CTkToplevel):
             if not self.root_app.data_state.save_state_reference:
                 self.root_app.data_state.save_state_reference = {}
             self.root_app.data_state.save_state_reference["DataSource"] = new_config
-            self.root_app.data_state.populate_data_source()
+            with self.root_app.engine.lock:
+                try:
+                    self.root_app.data_state.populate_data_source()
+                except (OSError, ValueError) as e:
+                    messagebox.showwarning(title="Failure", message=f'Data source could not be opened: {e}')
+                    return
             self.root_app.stop_animation()
             self.root_app.clear_all_data()
             messagebox.showinfo(title="Success", message="Data source successfully updated,"
@@ -9,7 +9,7 @@ class PeriodicityFrame(ctk.CTkFrame):
         self.columnconfigure(0, weight=1)
         self.columnconfigure(1, weight=1)
 
-        self.title_label = ctk.CTkLabel(self, text="Chart and Data Refresh Periodicity (milliseconds)", fg_color="gray30", corner_radius=6)
+        self.title_label = ctk.CTkLabel(self, text="Chart Refresh Periodicity (milliseconds)", fg_color="gray30", corner_radius=6)
         self.title_label.grid(row=0, column=0, padx=5, pady=(10, 0), sticky="ew", columnspan=2)
 
         self.periodicity_label = ctk.CTkLabel(self, text="Refresh Periodicity (ms):")
@@ -13,7 +13,8 @@ class StatisticFunctionConfigWindows(ctk.CTkToplevel):
         self.columnconfigure(0, weight=1)
         self.columnconfigure(1, weight=1)
 
-        if function_name in ('simple_moving_average', 'std_dev', 'variance'):
+        if function_name in ('simple_moving_average', 'std_dev', 'variance', 'geometric_mean', 'rolling_median',
+                             'interquartile_range'):
             self.calculation_size = ctk.StringVar()
             self.calculation_time_type = ctk.StringVar()
             self.size_entry_label = ctk.CTkLabel(self, text="Calculation Size:")
@@ -92,6 +93,52 @@ class StatisticFunctionConfigWindows(ctk.CTkToplevel):
                 self.calculation_time_type.set('ms')
                 self.alpha.set(str(Config.Config.get("DEFAULT_EWMA_ALPHA")))
 
+        elif function_name == 'rolling_quantile':
+            self.calculation_size = ctk.StringVar()
+            self.calculation_time_type = ctk.StringVar()
+            self.quantile = ctk.StringVar()
+            self.size_entry_label = ctk.CTkLabel(self, text="Calculation Size:")
+            self.size_entry = ctk.CTkEntry(self, textvariable=self.calculation_size)
+            self.size_entry_label.grid(row=0, column=0, sticky='ew', padx=5, pady=5)
+            self.size_entry.grid(row=0, column=1, sticky='ew', padx=5, pady=5)
+            self.quantile_entry_label = ctk.CTkLabel(self, text="Quantile (0 to 1):")
+            self.quantile_entry = ctk.CTkEntry(self, textvariable=self.quantile)
+            self.quantile_entry_label.grid(row=1, column=0, sticky='ew', padx=5, pady=5)
+            self.quantile_entry.grid(row=1, column=1, sticky='ew', padx=5, pady=5)
+            self.calc_time_type_label = ctk.CTkLabel(self, text="Calculation time type:")
+            self.calc_time_type_label.grid(row=2, column=0, sticky='ew', padx=5, pady=5)
+            self.calc_time_type_picker = ctk.CTkComboBox(self, values=['ms', 'points'],
+                                                         variable=self.calculation_time_type)
+            self.calc_time_type_picker.grid(row=2, column=1, sticky='ew', padx=5, pady=5)
+
+            def save_config():
+                size = self.calculation_size.get()
+                size_type = self.calculation_time_type.get()
+                quantile = self.quantile.get()
+                if not size:
+                    size = float(Config.Config.get("DEFAULT_STAT_CALC_SIZE"))
+                else:
+                    size = float(size)
+                if not size_type:
+                    size_type = 'ms'
+                quantile = float(quantile) if quantile else 0.5
+                if not 0 <= quantile <= 1:
+                    messagebox.showwarning(title="Failure", message='Quantile must be between 0 and 1')
+                    return
+                self.master.stat_function_kwargs = {'size': size, 'size_type': size_type, 'quantile': quantile}
+
+            self.save_button = ctk.CTkButton(self, text="Save", command=save_config)
+            self.save_button.grid(row=3, column=1, sticky='ew', padx=5, pady=5)
+
+            if stat_state is not None:
+                self.calculation_size.set(str(stat_state.fill_kwargs['size']))
+                self.calculation_time_type.set(str(stat_state.fill_kwargs['size_type']))
+                self.quantile.set(str(stat_state.fill_kwargs.get('quantile', 0.5)))
+            else:
+                self.calculation_size.set(str(Config.Config.get("DEFAULT_STAT_CALC_SIZE")))
+                self.calculation_time_type.set('ms')
+                self.quantile.set('0.5')
+
 
 class StatisticFrame(ctk.CTkFrame):
     def __init__(self, master, type: str):
@@ -164,7 +211,8 @@ class StatisticFrame(ctk.CTkFrame):
             messagebox.showinfo(title="Warning", message="Please fill in: %s" % ', '.join(blanks))
         else:
             self.root_app.data_state.save_state_reference[self.type] = new_stat_config | {'plot': True}
-            self.root_app.data_state.populate_statistic(statistic_type=self.type)
+            with self.root_app.engine.lock:
+                self.root_app.data_state.populate_statistic(statistic_type=self.type)
             messagebox.showinfo(title="Success", message="Statistic Created")
 
     def configure_stat(self):
@@ -182,10 +230,11 @@ class StatisticFrame(ctk.CTkFrame):
         if not delete_confirm or delete_confirm is None:
             return
 
-        if self.type == 'CentralLocationStatistic':
-            self.root_app.data_state.clear_central_location_statistic()
-        elif self.type == 'SpreadStatistic':
-            self.root_app.data_state.clear_spread_statistic()
+        with self.root_app.engine.lock:
+            if self.type == 'CentralLocationStatistic':
+                self.root_app.data_state.clear_central_location_statistic()
+            elif self.type == 'SpreadStatistic':
+                self.root_app.data_state.clear_spread_statistic()
 
 
 class StatisticsWindow(ctk.CTkToplevel):
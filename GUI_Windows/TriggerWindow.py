@@ -28,7 +28,8 @@ class AddNewTrigger(ctk.CTkToplevel):
         self.name_label.grid(row=0, column=0, padx=5, pady=5, sticky='ew')
         self.name_entry.grid(row=0, column=1, padx=5, pady=5, sticky='ew')
 
-        self.valid_trigger_functions = ['Std Dev Away From Mean', 'High Run', 'Consistently Increasing', 'Consistently Increasing']
+        self.valid_trigger_functions = ['Std Dev Away From Mean', 'High Run', 'Consistently Increasing', 'Consistently Increasing',
+                                        'Western Electric Rules', 'Nelson Rules']
         self.trigger_picker = ctk.CTkComboBox(self.source_and_function_frame, values=self.valid_trigger_functions,
                                               command=self.select_function, variable=self.trigger_selection)
         self.trigger_picker.grid(row=1, column=1, padx=5, pady=5, sticky='ew')
@@ -63,7 +64,8 @@ class AddNewTrigger(ctk.CTkToplevel):
         self.trigger_settings_frame = ctk.CTkFrame(self)
         self.trigger_settings_frame.columnconfigure(0, weight=1)
 
-        if selected_function in ('Consistently Increasing', 'Consistently Increasing'):
+        if selected_function in ('Consistently Increasing', 'Consistently Increasing', 'Western Electric Rules',
+                                 'Nelson Rules'):
             return
 
         if selected_function == 'Std Dev Away From Mean':
@@ -140,8 +142,9 @@ class AddNewTrigger(ctk.CTkToplevel):
             else:
                 self.root_app.data_state.save_state_reference['Triggers'] = [trigger_dict]
 
-            new_trigger = self.root_app.data_state.create_trigger_from_dict(trigger_dict | {"buffer": source_buffer})
-            self.root_app.data_state.add_trigger_state(new_trigger)
+            with self.root_app.engine.lock:
+                new_trigger = self.root_app.data_state.create_trigger_from_dict(trigger_dict | {"buffer": source_buffer})
+                self.root_app.data_state.add_trigger_state(new_trigger)
             self.master.layout_trigger_frames()
             self.destroy()
 
@@ -178,7 +181,8 @@ class TriggerFrame(ctk.CTkFrame):
         if not delete_confirm or delete_confirm is None:
             return
 
-        self.data_state.trigger_states.remove(self.trigger_state)
+        with self.root_app.engine.lock:
+            self.data_state.trigger_states.remove(self.trigger_state)
         self.trigger_state = None
         self.master.layout_trigger_frames()
         self.destroy()
@@ -0,0 +1,362 @@
+import atexit
+import contextlib
+import os
+import pathlib
+import queue
+import struct
+import threading
+import time
+import warnings
+from dataclasses import dataclass
+from datetime import datetime
+import numpy as np
+from Config import Config
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+OUTPUT_FLUSH_INTERVAL_MS = Config.get('OUTPUT_FLUSH_INTERVAL_MS')
+OUTPUT_TIMESTAMP_FORMAT = "%Y_%m_%d-%H%M_%S_%f"
+
+
+# Schema shared by every output format: wall clock time the rows were written (seconds since the epoch), the
+# buffer's time value and the datum
+TRIGGER_OUTPUT_DTYPE = np.dtype([('written_at', '<f8'), ('time', '<i8'), ('datum', '<f8')])
+OUTPUT_FORMATS = ('csv', 'npy', 'parquet')
+OUTPUT_FILE_SUFFIXES = {'csv': '', 'npy': '.npy', 'parquet': '.parquet'}
+# Appendable .npy files are given a fixed size header so the row count in it can be rewritten in place
+_NPY_HEADER_SIZE = 128
+
+
+def check_output_format(output_format: str):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Trigger output format "{output_format}" is not recognized, use one of {OUTPUT_FORMATS}')
+    if output_format == 'parquet' and pq is None:
+        raise ValueError('The parquet trigger output format requires pyarrow to be installed')
+
+
+def _npy_header(count: int) -> bytes:
+    header = str({'descr': np.lib.format.dtype_to_descr(TRIGGER_OUTPUT_DTYPE), 'fortran_order': False,
+                  'shape': (count,)})
+    header = header.ljust(_NPY_HEADER_SIZE - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+@contextlib.contextmanager
+def _exclusive(f):
+    # Holds a lock on a file several processes append to (e.g. the combined log of charts run by
+    # Engine.ProcessChartEngine), so each can find the true end of the file and write there
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _records(written_at: float, times, data) -> np.ndarray:
+    records = np.empty(len(times), dtype=TRIGGER_OUTPUT_DTYPE)
+    records['written_at'] = written_at
+    records['time'] = times
+    records['datum'] = data
+    return records
+
+
+def load_trigger_output(path) -> np.ndarray:
+    """Loads an individual trigger output file of any format into a TRIGGER_OUTPUT_DTYPE array"""
+    path = pathlib.Path(path)
+    if path.suffix == '.npy':
+        return np.load(path)
+    if path.suffix == '.parquet':
+        if pq is None:
+            raise ValueError('Reading parquet trigger output requires pyarrow to be installed')
+        table = pq.read_table(path)
+        records = np.empty(table.num_rows, dtype=TRIGGER_OUTPUT_DTYPE)
+        for name in TRIGGER_OUTPUT_DTYPE.names:
+            records[name] = table.column(name).to_numpy()
+        return records
+    with open(path) as f:
+        rows = [line.rstrip('\n').split('\t') for line in f if line.strip()]
+    records = np.empty(len(rows), dtype=TRIGGER_OUTPUT_DTYPE)
+    for i, (timestamp, t, d) in enumerate(rows):
+        records[i] = (datetime.strptime(timestamp, OUTPUT_TIMESTAMP_FORMAT).timestamp(), int(float(t)), float(d))
+    return records
+
+
+@dataclass
+class _WriteRequest:
+    path: pathlib.Path
+    written_at: float
+    times: list
+    data: list
+    name: str = None
+    truncate: bool = False
+    index_path: pathlib.Path = None
+    output_format: str = 'csv'
+
+
+class _Flush:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class _Stop(_Flush):
+    pass
+
+
+@dataclass
+class _CloseFile:
+    path: pathlib.Path
+
+
+@dataclass
+class _EndChain:
+    index_path: pathlib.Path
+    name: str
+
+
+class TriggerOutputWriter:
+    """Write-behind sink for trigger output files.
+
+    Callers queue rows and return immediately; a background thread collects whatever is queued for up to
+    flush_interval_ms, then writes it with one open per file per batch. Text rows are tab separated as
+    [name,] formatted write time, time, datum; 'npy' and 'parquet' files hold TRIGGER_OUTPUT_DTYPE records. Writes
+    given an index_path are tracked per name as one chain, whose entry is appended to that index when end_chain is
+    called (or the writer closes), see CombinedTriggerLog.
+    """
+    def __init__(self, flush_interval_ms: float = OUTPUT_FLUSH_INTERVAL_MS, max_batch_items: int = 10000):
+        self.flush_interval_ms = flush_interval_ms
+        self.max_batch_items = max_batch_items
+        self._queue = queue.SimpleQueue()
+        # Parquet files stay open for the length of a trigger chain, only the writer thread touches these
+        self._parquet_writers = {}
+        # (index path, name) -> [first time, last time, start offset, end offset] of chains not yet indexed
+        self._open_chains = {}
+        self._thread = threading.Thread(target=self._run, name='TriggerOutputWriter', daemon=True)
+        self._closed = False
+        self._thread.start()
+
+    def write(self, path, written_at: float, times, data, name: str = None, truncate: bool = False,
+              index_path=None, output_format: str = 'csv'):
+        """Queue rows for path. times and data must not be modified afterwards, pass copies of live buffers."""
+        if self._closed:
+            raise ValueError('Trigger output writer has been closed')
+        index_path = pathlib.Path(index_path) if index_path is not None else None
+        self._queue.put(_WriteRequest(path=pathlib.Path(path), written_at=written_at, times=times, data=data,
+                                      name=name, truncate=truncate, index_path=index_path,
+                                      output_format=output_format))
+
+    def close_file(self, path):
+        """Marks the end of writes to path (e.g. a finished trigger chain) so formats that hold the file open close it"""
+        if not self._closed:
+            self._queue.put(_CloseFile(pathlib.Path(path)))
+
+    def end_chain(self, index_path, name: str):
+        """Marks the end of a chain of indexed writes under name, writing its index entry"""
+        if not self._closed:
+            self._queue.put(_EndChain(pathlib.Path(index_path), name))
+
+    def flush(self, timeout: float = None):
+        """Blocks until everything queued before this call has been written"""
+        if self._closed:
+            return
+        marker = _Flush()
+        self._queue.put(marker)
+        marker.done.wait(timeout)
+
+    def close(self, timeout: float = None):
+        if self._closed:
+            return
+        self._closed = True
+        marker = _Stop()
+        self._queue.put(marker)
+        marker.done.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval_ms / 1000.0
+            while len(batch) < self.max_batch_items and not isinstance(batch[-1], _Flush):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            stop = self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch) -> bool:
+        files = {}
+        stop = False
+        try:
+            for item in batch:
+                if isinstance(item, _Flush):
+                    stop = stop or isinstance(item, _Stop)
+                    continue
+                try:
+                    if isinstance(item, _CloseFile):
+                        if item.path in self._parquet_writers:
+                            self._parquet_writers.pop(item.path).close()
+                    elif isinstance(item, _EndChain):
+                        self._write_index_entry(item.index_path, item.name, files)
+                    elif item.output_format == 'npy':
+                        self._write_npy(item)
+                    elif item.output_format == 'parquet':
+                        self._write_parquet(item)
+                    else:
+                        self._write_text(item, files)
+                except OSError as e:
+                    path = item.index_path if isinstance(item, _EndChain) else item.path
+                    warnings.warn(f'Could not write trigger output to "{path}": {e}')
+        finally:
+            if stop:
+                for index_path, name in list(self._open_chains):
+                    try:
+                        self._write_index_entry(index_path, name, files)
+                    except OSError as e:
+                        warnings.warn(f'Could not write trigger output to "{index_path}": {e}')
+            for f in files.values():
+                f.close()
+            if stop:
+                for parquet_writer in self._parquet_writers.values():
+                    parquet_writer.close()
+                self._parquet_writers.clear()
+            for item in batch:
+                if isinstance(item, _Flush):
+                    item.done.set()
+        return stop
+
+    def _write_text(self, item: _WriteRequest, files: dict):
+        path = item.path
+        if item.truncate or path not in files:
+            if path in files:
+                files[path].close()
+            files[path] = open(path, 'wb' if item.truncate else 'ab')
+        timestamp = datetime.fromtimestamp(item.written_at).strftime(OUTPUT_TIMESTAMP_FORMAT)
+        prefix = f'{item.name}\t{timestamp}\t' if item.name is not None else f'{timestamp}\t'
+        rows = ''.join(f'{prefix}{t}\t{d}\r\n' for t, d in zip(item.times, item.data)).encode()
+        if item.index_path is None:
+            files[path].write(rows)
+            return
+        # Other processes may be appending to the same log, the offset recorded has to be where the rows really went
+        with _exclusive(files[path]):
+            files[path].seek(0, os.SEEK_END)
+            offset = files[path].tell()
+            files[path].write(rows)
+            files[path].flush()
+        if rows:
+            chain = self._open_chains.setdefault((item.index_path, item.name), [item.times[0], None, offset, None])
+            chain[1], chain[3] = item.times[-1], offset + len(rows)
+
+    def _write_index_entry(self, index_path: pathlib.Path, name: str, files: dict):
+        chain = self._open_chains.pop((index_path, name), None)
+        if chain is None:
+            return
+        first_time, last_time, start, end = chain
+        if index_path not in files:
+            files[index_path] = open(index_path, 'ab')
+        with _exclusive(files[index_path]):
+            files[index_path].write(CombinedTriggerLog.index_entry(name, first_time, last_time, start, end - start))
+            files[index_path].flush()
+
+    @staticmethod
+    def _write_npy(item: _WriteRequest):
+        if item.truncate or not item.path.exists():
+            with open(item.path, 'wb') as f:
+                f.write(_npy_header(0))
+        with open(item.path, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            f.write(_records(item.written_at, item.times, item.data).tobytes())
+            count = (f.tell() - _NPY_HEADER_SIZE) // TRIGGER_OUTPUT_DTYPE.itemsize
+            f.seek(0)
+            f.write(_npy_header(count))
+
+    def _write_parquet(self, item: _WriteRequest):
+        if item.truncate and item.path in self._parquet_writers:
+            self._parquet_writers.pop(item.path).close()
+        if item.path not in self._parquet_writers:
+            schema = pa.schema([('written_at', pa.float64()), ('time', pa.int64()), ('datum', pa.float64())])
+            self._parquet_writers[item.path] = pq.ParquetWriter(item.path, schema)
+        records = _records(item.written_at, item.times, item.data)
+        self._parquet_writers[item.path].write_table(
+            pa.table({name: records[name] for name in TRIGGER_OUTPUT_DTYPE.names}))
+
+
+class CombinedTriggerLog:
+    """Append-only log of every trigger's output with a sidecar index.
+
+    Each trigger chain written to the log gets one tab separated index line once it ends: trigger name, first and last
+    time of the chain, and the byte offset and length of the span of the log holding its rows. Other triggers' rows
+    can be interleaved within that span and are skipped when it is read. Looking up events reads only the (small)
+    index and then seeks straight to the matching rows. Chains still in progress are not in the index yet.
+    """
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.index_path = self.path.with_name(self.path.name + '.idx')
+
+    @staticmethod
+    def index_entry(name: str, first_time, last_time, offset: int, length: int) -> bytes:
+        return f'{name}\t{first_time}\t{last_time}\t{offset}\t{length}\n'.encode()
+
+    def find(self, name: str = None, start_time: float = None, end_time: float = None) -> list[tuple]:
+        """Index entries (name, first time, last time, offset, length) overlapping the given name and time range"""
+        if not self.index_path.exists():
+            return []
+        entries = []
+        with open(self.index_path, 'rb') as f:
+            for line in f:
+                entry_name, first_time, last_time, offset, length = line.decode().rstrip('\n').rsplit('\t', 4)
+                if name is not None and entry_name != name:
+                    continue
+                first_time, last_time = float(first_time), float(last_time)
+                if (start_time is not None and last_time < start_time) or (end_time is not None and first_time > end_time):
+                    continue
+                entries.append((entry_name, first_time, last_time, int(offset), int(length)))
+        return entries
+
+    def read(self, name: str = None, start_time: float = None, end_time: float = None) -> list[list[str]]:
+        """Rows ([name, formatted write time, time, datum]) of the matching events"""
+        rows = []
+        with open(self.path, 'rb') as f:
+            for entry_name, _, _, offset, length in self.find(name=name, start_time=start_time, end_time=end_time):
+                f.seek(offset)
+                rows.extend(row for row in (line.split('\t') for line in f.read(length).decode().splitlines())
+                            if row[0] == entry_name)
+        return rows
+
+
+_shared_writer = None
+_shared_writer_lock = threading.Lock()
+
+
+def get_shared_writer() -> TriggerOutputWriter:
+    # One writer is shared by every trigger in the process and is flushed when the interpreter exits
+    global _shared_writer
+    with _shared_writer_lock:
+        if _shared_writer is None:
+            _shared_writer = TriggerOutputWriter()
+            atexit.register(_shared_writer.close)
+        return _shared_writer
@@ -1,11 +1,29 @@
 import json
 import pathlib
+import dataclasses
+from dataclasses import dataclass
 import Trigger
 import Buffer
+import DataSources
 import statistics
 import trigger_functions
 
 
+@dataclass
+class TriggerPlotSnapshot:
+    name: str
+    source: str
+    plots: list[Trigger.TriggerPlotData]
+
+
+@dataclass
+class StateSnapshot:
+    data_source: Buffer.BufferSnapshot | None
+    central_location_statistic: Buffer.BufferSnapshot | None
+    spread_statistic: Buffer.BufferSnapshot | None
+    trigger_plots: list[TriggerPlotSnapshot]
+
+
 class State:
     def __init__(self):
         self.data_source: Buffer.DataBuffer | None = None
@@ -15,12 +33,18 @@ class State:
         self.save_state_reference: dict | None = None
 
     def clear_data_source(self):
+        if self.data_source is not None:
+            self.data_source.close()
         self.data_source = None
 
     def clear_central_location_statistic(self):
+        if self.central_location_statistic is not None:
+            self.central_location_statistic.close()
         self.central_location_statistic = None
 
     def clear_spread_statistic(self):
+        if self.spread_statistic is not None:
+            self.spread_statistic.close()
         self.spread_statistic = None
 
     def open_save_file(self, file_path: str):
@@ -36,12 +60,26 @@ class State:
 
     def populate_data_source(self):
         data_source_dict = self.save_state_reference['DataSource']
+        # The old source has to let go of its socket or pipe before the new one can open it
+        self.clear_data_source()
         kwargs = {'name': data_source_dict['name'],
                   'filepath': data_source_dict['filepath'],
                   'capacity': data_source_dict['capacity'],
                   'capacity_type': data_source_dict['capacity_type']}
         if 'kwargs' in data_source_dict:
             kwargs = kwargs | data_source_dict['kwargs']
+        if 'source_type' in data_source_dict:
+            kwargs['source_type'] = data_source_dict['source_type']
+        # The data source window saves the line layout alongside the other settings
+        layout_keys = ('seperator', 'data_position', 'timestamp_position', 'timestamp_format')
+        layout = {key: data_source_dict[key] for key in layout_keys if key in data_source_dict}
+        if layout and kwargs.get('source_type', 'file') != 'shared_memory':
+            kwargs['fill_kwargs'] = (kwargs.get('fill_kwargs') or {}) | layout
+        if kwargs.get('fill_kwargs') and 'seperator' in kwargs['fill_kwargs']:
+            kwargs['fill_kwargs'] = kwargs['fill_kwargs'] | \
+                {'seperator': DataSources.delimiter(kwargs['fill_kwargs']['seperator'])}
+        if data_source_dict.get('archive_path'):
+            kwargs['archive_path'] = data_source_dict['archive_path']
         self.data_source = Buffer.DataBuffer(**kwargs)
 
     def populate_statistic(self, statistic_type: str = 'CentralLocationStatistic'):
@@ -56,12 +94,16 @@ class State:
                       'data_name': reference_dict['data_name']}
             if reference_dict['stat_function_kwargs']:
                 kwargs['fill_kwargs'] = reference_dict['stat_function_kwargs']
+            if reference_dict.get('archive_path'):
+                kwargs['archive_path'] = reference_dict['archive_path']
 
             return statistics.StatBuffer(**kwargs)
 
         if statistic_type == 'CentralLocationStatistic':
+            self.clear_central_location_statistic()
             self.central_location_statistic = _create_stat_buffer(self.save_state_reference['CentralLocationStatistic'])
         elif statistic_type == 'SpreadStatistic':
+            self.clear_spread_statistic()
             self.spread_statistic = _create_stat_buffer(self.save_state_reference['SpreadStatistic'])
         else:
             raise ValueError(f'Statistic type of {statistic_type} is not recognized, please verify your save file')
@@ -88,6 +130,8 @@ class State:
                   "trigger_function": trigger_functions.get_trigger_function(trigger_dict["trigger_function"])}
         if trigger_dict["trigger_kwargs"]:
             kwargs["trigger_kwargs"] = trigger_dict["trigger_kwargs"]
+        if "output_format" in trigger_dict:
+            kwargs["output_format"] = trigger_dict["output_format"]
         return Trigger.Trigger(**kwargs)
 
     def add_trigger_state(self, trigger):
@@ -100,6 +144,48 @@ class State:
             trigger = self.create_trigger_from_dict(trigger_reference)
             self.add_trigger_state(trigger)
 
+    def process_next_frame(self):
+        # Ingest whatever the data source has produced, then update the statistics and run the triggers over it
+        if self.data_source is None:
+            return 0
+        new_points = self.data_source.fill_next_frame()
+        if not new_points:
+            return 0
+
+        if self.central_location_statistic is not None:
+            self.central_location_statistic.fill_next_frame()
+        if self.spread_statistic is not None:
+            self.spread_statistic.fill_next_frame()
+        self.run_triggers()
+        return new_points
+
+    def run_triggers(self, trigger_states: list = None):
+        for trigger_state in self.trigger_states if trigger_states is None else trigger_states:
+            trigger = trigger_state.trigger
+            if trigger.active and trigger.run():
+                trigger_state.plots.add_trigger_plot(trigger)
+            if trigger_state.plots:
+                trigger_state.plots.remove_old_plot_data(old_time=self.data_source.time[0])
+
+    def snapshot(self) -> StateSnapshot:
+        # Copies of everything needed for rendering, so a reader never sees buffers being modified under it
+        def _buffer_snapshot(buffer):
+            return buffer.snapshot() if buffer is not None else None
+
+        trigger_plots = []
+        for trigger_state in self.trigger_states:
+            if not trigger_state.trigger.active:
+                continue
+            plots = [dataclasses.replace(plot, data=list(plot.data), time=list(plot.time))
+                     for plot in trigger_state.plots]
+            trigger_plots.append(TriggerPlotSnapshot(name=trigger_state.trigger.name,
+                                                     source=trigger_state.trigger.source, plots=plots))
+
+        return StateSnapshot(data_source=_buffer_snapshot(self.data_source),
+                             central_location_statistic=_buffer_snapshot(self.central_location_statistic),
+                             spread_statistic=_buffer_snapshot(self.spread_statistic),
+                             trigger_plots=trigger_plots)
+
     def populate_state_from_reference(self):
         if 'DataSource' in self.save_state_reference:
             self.populate_data_source()
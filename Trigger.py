@@ -1,48 +1,97 @@
+import abc
 import collections
 from typing import Callable, Union
 import Buffer
 import statistics
 import functools
 from typing import Union
-import bisect
+import numpy as np
 import pathlib
-import csv
+import time
 from datetime import datetime
+import OutputWriter
 from Config import Config
 from dataclasses import dataclass
 
 
-TRIGGER_OUTPUT_INDIVIDUAL_FILE_DIR = Config.get('TRIGGER_OUTPUT_INDIVIDUAL_FILE_DIR')
-TRIGGER_OUTPUT_DIR = Config.get('TRIGGER_OUTPUT_DIR')
+TRIGGER_OUTPUT_INDIVIDUAL_FILE_DIR = Config.get_path('TRIGGER_OUTPUT_INDIVIDUAL_FILE_DIR')
+TRIGGER_OUTPUT_DIR = Config.get_path('TRIGGER_OUTPUT_DIR')
 TRIGGER_OUTPUT_COMBINED_FILE_NAME = Config.get('TRIGGER_OUTPUT_COMBINED_FILE_NAME')
 
 
+class StreamingRule(abc.ABC):
+    """Trigger rule that keeps state between runs and is only fed the points added to the buffer since its last run,
+    so its cost per frame follows the new data rather than the window size.
+
+    Points are identified by absolute index (see Buffer.total_points), the rule fires when the condition holds over
+    the window [window_start, window_end). Called with a trigger it is evaluated afresh over trigger.current_data, so
+    it can still be used wherever a plain trigger function is expected (e.g. combine_triggers).
+
+    Rules with evaluates_series set can also be evaluated over a whole series at once with fired_series.
+    """
+    evaluates_series = False
+
+    @abc.abstractmethod
+    def reset(self):
+        ...
+
+    @abc.abstractmethod
+    def update(self, buffer: Buffer.Buffer, new_data: np.ndarray, first_index: int):
+        ...
+
+    @abc.abstractmethod
+    def fired(self, window_start: int, window_end: int) -> bool:
+        ...
+
+    def fired_series(self, values: np.ndarray, window_starts: np.ndarray, buffer_starts: np.ndarray) -> np.ndarray:
+        # Whether the rule fires with each point as the newest, given where the window and the buffer then start
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def __call__(self, trigger) -> bool:
+        ...
+
+
 class Trigger:
     def __init__(self, name: str, buffer: Union[Buffer.Buffer, statistics.StatBuffer], window_size: float,
                  trigger_function: Callable, source_buffer_name, output_to_file=True,
                  output_individual_file_directory=TRIGGER_OUTPUT_INDIVIDUAL_FILE_DIR,
                  output_combined_file_directory=TRIGGER_OUTPUT_DIR, output_combined_file_name=TRIGGER_OUTPUT_COMBINED_FILE_NAME,
-                 trigger_kwargs=None, active=True, window_type: str = 'ms', source: str = "CentralLocationStatistic"):
+                 trigger_kwargs=None, active=True, window_type: str = 'ms', source: str = "CentralLocationStatistic",
+                 output_writer: OutputWriter.TriggerOutputWriter = None, output_format: str = 'csv'):
         self.name = name
         self.buffer = buffer
         self.source = source
         self.source_buffer_name = source_buffer_name
         self.window_size = window_size
         self.window_type = window_type
-        self.trigger_function = functools.partial(trigger_function, **trigger_kwargs) if trigger_kwargs else trigger_function
+        if isinstance(trigger_function, type) and issubclass(trigger_function, StreamingRule):
+            # Streaming rules are classes, each trigger gets its own instance holding the rule's state
+            self.trigger_function = trigger_function(**(trigger_kwargs or {}))
+        else:
+            self.trigger_function = functools.partial(trigger_function, **trigger_kwargs) if trigger_kwargs \
+                else trigger_function
+        self._points_seen = None
+        self._generation = None
         self.active = active
         self.current_data = None
         self.current_time = None
-        self.current_time_stamps = None
         self.trigger_chain_status = False
         self.trigger_chain_data = None
         self.trigger_chain_time = None
-        self.trigger_chain_timestamps = None
         self.output_to_file = output_to_file
         self.output_file_individual_directory = output_individual_file_directory
         self.output_combined_file_directory = output_combined_file_directory
         self.output_combined_file_name = output_combined_file_name
         self.trigger_chain_output_file = None
+        self.output_writer = output_writer if output_writer is not None else OutputWriter.get_shared_writer()
+        OutputWriter.check_output_format(output_format)
+        self.output_format = output_format  # Format of the individual chain files, the combined log is always text
+        self.combined_log = OutputWriter.CombinedTriggerLog(pathlib.Path(output_combined_file_directory)
+                                                            / output_combined_file_name)
+        if output_to_file:
+            pathlib.Path(output_individual_file_directory).mkdir(parents=True, exist_ok=True)
+            pathlib.Path(output_combined_file_directory).mkdir(parents=True, exist_ok=True)
 
     def deactivate(self):
         self.active = False
@@ -51,22 +100,32 @@ class Trigger:
         self.active = True
 
     def reset_chain_status(self):
+        if self.trigger_chain_output_file is not None:
+            self.output_writer.close_file(self.trigger_chain_output_file)
+            self.output_writer.end_chain(self.combined_log.index_path, self.name)
         self.trigger_chain_status = False
         self.trigger_chain_data = None
         self.trigger_chain_time = None
         self.trigger_chain_output_file = None
 
+    def write_chain(self, chain_time, chain_data, ended: bool = True):
+        """Writes a whole trigger chain at once, as run() would have written it frame by frame (e.g. a chain found
+        evaluating the trigger over a history). A chain that has not ended is left open for run() to continue."""
+        self.trigger_chain_status = True
+        self.trigger_chain_time = list(chain_time)
+        self.trigger_chain_data = list(chain_data)
+        if self.output_to_file:
+            written_at = time.time()
+            self._export_time_and_data_to_individual_file(written_at)
+            self._export_time_and_data_to_combined_file(written_at)
+        if ended:
+            self.reset_chain_status()
+
     def get_buffer_time_and_data(self):
         if self.window_type in ('ms', 's'):
-            data = self.buffer.tail_data_by_time_duration(self.window_size)
-            times = self.buffer.tail_time_by_time_duration(self.window_size)
-            time_stamps = self.buffer.tail_timestamps_by_time_duration(self.window_size)
-        else:
-            data = self.buffer.tail_data(self.window_size)
-            times = self.buffer.tail_time(self.window_size)
-            time_stamps = self.buffer.tail_timestamps(self.window_size)
-
-        return time_stamps, times, data
+            i = self.buffer.window_start_index(self.window_size)
+            return self.buffer.time[i:], self.buffer.data[i:]
+        return self.buffer.tail_time(self.window_size), self.buffer.tail_data(self.window_size)
 
     def run(self):
         if not self.active:
@@ -75,77 +134,97 @@ class Trigger:
         if self.window_type == 'ms' and self.buffer.get_timespan() < self.window_size:
             return False
 
-        self.current_time_stamps, self.current_time, self.current_data = self.get_buffer_time_and_data()
-        trigger_response = self.trigger_function(self)
+        if isinstance(self.trigger_function, StreamingRule):
+            trigger_response = self._run_streaming_rule()
+            if trigger_response and not self.trigger_chain_status:
+                # The window is only needed to start a chain
+                self.current_time, self.current_data = self.get_buffer_time_and_data()
+        else:
+            self.current_time, self.current_data = self.get_buffer_time_and_data()
+            trigger_response = self.trigger_function(self)
 
         if not self.trigger_chain_status:
             # Not currently in a trigger chain
             self.trigger_chain_status = trigger_response
             if trigger_response:
-                # Start trigger chain and set initial chain data and time
-                self.trigger_chain_time = self.current_time
-                self.trigger_chain_data = self.current_data
-                self.trigger_chain_timestamps = self.current_time_stamps
-                self._export_time_and_data_to_individual_file()
-                self._export_time_and_data_to_combined_file()
+                # Start trigger chain and set initial chain data and time. The current window is a view into the
+                # buffer's storage so it is copied out before the chain starts growing.
+                self.trigger_chain_time = list(self.current_time)
+                self.trigger_chain_data = list(self.current_data)
+                if self.output_to_file:
+                    written_at = time.time()
+                    self._export_time_and_data_to_individual_file(written_at)
+                    self._export_time_and_data_to_combined_file(written_at)
         else:
             if trigger_response:
                 # Continue the chain
-                new_time_stamps, new_time, new_data = self._get_new_time_and_data()
-                self._add_new_time_and_data(new_time_stamps=new_time_stamps, new_time=new_time, new_data=new_data)
-                self._append_time_and_data_to_individual_file(new_time=new_time, new_data=new_data)
-                self._append_time_and_data_to_combined_file(new_time=new_time, new_data=new_data)
+                new_time, new_data = self._get_new_time_and_data()
+                self._add_new_time_and_data(new_time=new_time, new_data=new_data)
+                if self.output_to_file and len(new_time):
+                    # The new points are views into the buffer, the writer gets its own copy
+                    written_at, new_time, new_data = time.time(), new_time.tolist(), new_data.tolist()
+                    self._append_time_and_data_to_individual_file(written_at, new_time=new_time, new_data=new_data)
+                    self._append_time_and_data_to_combined_file(written_at, new_time=new_time, new_data=new_data)
             else:
                 # Chain has ended
                 self.reset_chain_status()
         return trigger_response
 
-    def _export_time_and_data_to_individual_file(self):
-        timestamp = datetime.now().strftime("%Y_%m_%d-%H%M_%S_%f")
-        self.trigger_chain_output_file = pathlib.Path(self.output_file_individual_directory) / f'{timestamp}_{self.name}_trigger'
-        with open(self.trigger_chain_output_file, 'w', newline='') as f:
-            writer = csv.writer(f, delimiter='\t')
-            writer.writerows(zip([timestamp for i in range(len(self.trigger_chain_time))], self.trigger_chain_time, self.trigger_chain_data))
-
-    def _append_time_and_data_to_individual_file(self, new_time, new_data):
+    def _window_start_index(self) -> int:
+        oldest = self.buffer.total_points - len(self.buffer)
+        if self.window_type in ('ms', 's'):
+            return oldest + self.buffer.window_start_index(self.window_size)
+        return max(oldest, self.buffer.total_points - int(self.window_size))
+
+    def _run_streaming_rule(self) -> bool:
+        rule = self.trigger_function
+        total_points = self.buffer.total_points
+        oldest = total_points - len(self.buffer)
+        if self._points_seen is None or self._points_seen < oldest or self._generation != self.buffer.generation:
+            # First run, or points left the buffer before the rule saw them or it was cleared, so the rule's state no
+            # longer follows on
+            rule.reset()
+            self._points_seen = oldest
+            self._generation = self.buffer.generation
+        if self._points_seen < total_points:
+            rule.update(self.buffer, self.buffer.data[self._points_seen - oldest:], self._points_seen)
+            self._points_seen = total_points
+        return rule.fired(self._window_start_index(), total_points)
+
+    def _export_time_and_data_to_individual_file(self, written_at: float):
+        timestamp = datetime.fromtimestamp(written_at).strftime(OutputWriter.OUTPUT_TIMESTAMP_FORMAT)
+        file_name = f'{timestamp}_{self.name}_trigger{OutputWriter.OUTPUT_FILE_SUFFIXES[self.output_format]}'
+        self.trigger_chain_output_file = pathlib.Path(self.output_file_individual_directory) / file_name
+        self.output_writer.write(self.trigger_chain_output_file, written_at, list(self.trigger_chain_time),
+                                 list(self.trigger_chain_data), truncate=True, output_format=self.output_format)
+
+    def _append_time_and_data_to_individual_file(self, written_at: float, new_time, new_data):
         # Already writing to a file for the chain therefore append
-        timestamp = datetime.now().strftime("%Y_%m_%d-%H%M_%S_%f")
-        with open(self.trigger_chain_output_file, 'a', newline='') as f:
-            writer = csv.writer(f, delimiter='\t')
-            writer.writerows(zip([timestamp], new_time, new_data))
-
-    def _export_time_and_data_to_combined_file(self):
-        timestamp = datetime.now().strftime("%Y_%m_%d-%H%M_%S_%f")
-        out_file_path = pathlib.Path(self.output_combined_file_directory) / self.output_combined_file_name
-        with open(out_file_path, 'w', newline='') as f:
-            writer = csv.writer(f, delimiter='\t')
-            writer.writerows(zip([self.name for i in range(len(self.trigger_chain_time))],
-                                 [timestamp for i in range(len(self.trigger_chain_time))],
-                                 self.trigger_chain_time, self.trigger_chain_data))
-
-    def _append_time_and_data_to_combined_file(self, new_time, new_data):
-        timestamp = datetime.now().strftime("%Y_%m_%d-%H%M_%S_%f")
-        out_file_path = pathlib.Path(self.output_combined_file_directory) / self.output_combined_file_name
-        with open(out_file_path, 'a', newline='') as f:
-            writer = csv.writer(f, delimiter='\t')
-            writer.writerows(zip([self.name], [timestamp], new_time, new_data))
+        self.output_writer.write(self.trigger_chain_output_file, written_at, new_time, new_data,
+                                 output_format=self.output_format)
+
+    def _export_time_and_data_to_combined_file(self, written_at: float):
+        # The combined log is shared by every trigger so it is only ever appended to
+        self.output_writer.write(self.combined_log.path, written_at, list(self.trigger_chain_time),
+                                 list(self.trigger_chain_data), name=self.name, index_path=self.combined_log.index_path)
+
+    def _append_time_and_data_to_combined_file(self, written_at: float, new_time, new_data):
+        self.output_writer.write(self.combined_log.path, written_at, new_time, new_data, name=self.name,
+                                 index_path=self.combined_log.index_path)
 
     def _get_new_time_and_data(self):
         # Use the last saved time and find the point in the buffer where new time values start
-        new_data_index = bisect.bisect_right(self.buffer.time, self.trigger_chain_time[-1])
+        new_data_index = int(np.searchsorted(self.buffer.time, self.trigger_chain_time[-1], side='right'))
         num_new_data_points = len(self.buffer) - new_data_index
-        return self.buffer.tail_timestamps(num_new_data_points), self.buffer.tail_time(num_new_data_points), \
+        return self.buffer.tail_time(num_new_data_points), \
                self.buffer.tail_data(num_new_data_points)
 
-    def _add_new_time_and_data(self, new_time_stamps, new_time, new_data):
+    def _add_new_time_and_data(self, new_time, new_data):
         # Use the last saved time and find the point in the buffer where new time values start
         if self.trigger_chain_data is None:
             self.trigger_chain_data = []
         if self.trigger_chain_time is None:
             self.trigger_chain_time = []
-        if self.trigger_chain_timestamps is None:
-            self.trigger_chain_timestamps = []
-        self.trigger_chain_timestamps.extend(new_time_stamps)
         self.trigger_chain_time.extend(new_time)
         self.trigger_chain_data.extend(new_data)
 
@@ -188,8 +267,13 @@ class TriggerPlotData:
     trigger_name: str
     data: list
     time: list
-    timestamps: list
     earliest_time: Union[int, float]
+    time_unit: str = 'ms'
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        # Derived from the times only when a plot or export asks for them
+        return Buffer.to_datetime64(self.time, self.time_unit)
 
 
 class TriggerPlotDataCollection(collections.deque):
@@ -209,12 +293,11 @@ class TriggerPlotDataCollection(collections.deque):
             # The trigger is not a new plot, but rather a continuation of a trigger chain
             self[0].data = activated_trigger.trigger_chain_data
             self[0].time = activated_trigger.trigger_chain_time
-            self[0].timestamps = activated_trigger.trigger_chain_timestamps
         else:
             self.append(TriggerPlotData(trigger_name=activated_trigger.name,
                                         data=activated_trigger.trigger_chain_data,
                                         time=activated_trigger.trigger_chain_time,
-                                        timestamps=activated_trigger.trigger_chain_timestamps,
+                                        time_unit=activated_trigger.buffer.time_unit,
                                         earliest_time=activated_trigger.trigger_chain_time[0]))
 
 
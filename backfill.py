@@ -0,0 +1,202 @@
+import argparse
+import time
+from dataclasses import dataclass, field
+import numpy as np
+import Buffer
+import DataSources
+import statistics
+import State
+import Trigger
+import headless
+from Config import Config
+
+BACKFILL_FRAME_MS = Config.get('BACKFILL_FRAME_MS')
+
+
+@dataclass
+class BackfillSummary:
+    frames: int = 0
+    points: int = 0
+    seconds: float = 0.0
+    trigger_chains: dict[str, int] = field(default_factory=dict)
+    chain_lengths: dict[str, list[int]] = field(default_factory=dict)  # Frames each trigger chain lasted
+
+
+def read_history(data_source: Buffer.DataBuffer, sample_period_ms: float = 1) -> tuple[np.ndarray, np.ndarray]:
+    """Every point in the data source's file, read the same way the live reader would read them"""
+    if data_source.source_type != 'file':
+        raise ValueError(f'Only file data sources can be backfilled, not "{data_source.source_type}"')
+    fill_kwargs = {key: value for key, value in data_source.source_kwargs.items() if key != 'shared_reader'}
+    times, data = DataSources.time_and_file_reader(data_source.filepath, start_at_end=False, **fill_kwargs)()
+    if fill_kwargs.get('timestamp_position') is None:
+        # Live reads stamp points with the time they arrived, which means nothing for history. Space them evenly.
+        times = (np.arange(data.size) * sample_period_ms).astype(np.int64)
+    return times, data
+
+
+def statistic_series(stat_buffer: statistics.StatBuffer, times: np.ndarray, data: np.ndarray):
+    """The value the stat buffer would hold after every point of the history, or None when the statistic has no
+    whole series version and has to be calculated frame by frame"""
+    series_function = statistics.statistic_series_function_map.get(stat_buffer.stat_function_name)
+    if series_function is None:
+        return None
+    kwargs = dict(stat_buffer.fill_kwargs or {})
+    size = kwargs.pop('size', Config.get('DEFAULT_STAT_CALC_SIZE'))
+    size_type = kwargs.pop('size_type', 'ms')
+    data_buffer = stat_buffer.data_buffer
+    starts = statistics.window_start_indices(times, size, size_type, capacity=data_buffer.capacity,
+                                             capacity_type=data_buffer.capacity_type)
+    return series_function(data, starts, **kwargs)
+
+
+def frame_ends(times: np.ndarray, frame_ms: float) -> np.ndarray:
+    # Exclusive end index of each frame of data time, frames with no points are skipped as in live ingestion
+    if times.size == 0:
+        return np.empty(0, dtype=np.int64)
+    frame_numbers = (times - times[0]) // frame_ms
+    return np.append(np.flatnonzero(np.diff(frame_numbers)) + 1, times.size)
+
+
+def _ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    # Concatenation of arange(start, stop) for every pair
+    lengths = stops - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(offsets.size)
+
+
+def _evaluates_series(trigger) -> bool:
+    return isinstance(trigger.trigger_function, Trigger.StreamingRule) and trigger.trigger_function.evaluates_series
+
+
+def _replay_series_trigger(trigger, times: np.ndarray, values: np.ndarray, ends: np.ndarray,
+                           summary: BackfillSummary):
+    """Evaluates a streaming rule over the whole series its buffer would have held, ends being the buffer's length
+    after each frame, and writes the chains Trigger.run would have written frame by frame"""
+    buffer = trigger.buffer
+    # Starts of the whole buffer and of the trigger's window with each point as the newest
+    buffer_starts = statistics.window_start_indices(times, buffer.capacity, buffer.capacity_type,
+                                                    capacity=buffer.capacity, capacity_type=buffer.capacity_type)
+    window_starts = statistics.window_start_indices(times, trigger.window_size, trigger.window_type,
+                                                    capacity=buffer.capacity, capacity_type=buffer.capacity_type)
+    frames = np.flatnonzero(ends > 0)
+    newest = ends - 1
+    if trigger.window_type == 'ms':
+        # Trigger.run does nothing until the buffer spans the window
+        frames = frames[times[newest[frames]] - times[buffer_starts[newest[frames]]] >= trigger.window_size]
+    fired = trigger.trigger_function.fired_series(values, window_starts, buffer_starts)[newest[frames]]
+    in_chain = np.concatenate(([False], fired[:-1]))
+    starts = frames[fired & ~in_chain]
+    stops = frames[~fired & in_chain]
+    summary.trigger_chains[trigger.name] += int(starts.size)
+    summary.chain_lengths[trigger.name].extend((np.append(stops, ends.size)[:starts.size] - starts).tolist())
+    if not trigger.output_to_file or not starts.size:
+        return
+
+    # Each chain is its window when it started and then, every frame it carries on, the points newer than the last
+    # one it holds still in the buffer
+    continued = np.flatnonzero(fired & in_chain)
+    continued_ends = ends[frames[continued]]
+    previous_newest = times[ends[frames[continued - 1]] - 1]
+    continued_starts = np.maximum(np.searchsorted(times, previous_newest, side='right'),
+                                  buffer_starts[continued_ends - 1])
+    continued_points = _ranges(continued_starts, continued_ends)
+    chain_of_point = np.repeat(np.cumsum(fired & ~in_chain)[continued] - 1, continued_ends - continued_starts)
+    splits = np.searchsorted(chain_of_point, np.arange(1, starts.size)).tolist()
+    for chain, (start, points) in enumerate(zip(ends[starts].tolist(), np.split(continued_points, splits))):
+        points = np.concatenate((np.arange(window_starts[start - 1], start), points))
+        trigger.write_chain(times[points], values[points], ended=chain < stops.size)
+
+
+def replay(state: State.State, times: np.ndarray, data: np.ndarray,
+           frame_ms: float = BACKFILL_FRAME_MS) -> BackfillSummary:
+    """Feeds a whole history through the state's buffers a frame of data time at a time, giving the same triggers
+    as running them after each frame. Statistics are precomputed over the whole series where possible and streaming
+    trigger rules evaluated over the whole series, only the rest are calculated frame by frame."""
+    started = time.perf_counter()
+    ends = frame_ends(times, frame_ms)
+    stat_buffers = [buffer for buffer in (state.central_location_statistic, state.spread_statistic)
+                    if buffer is not None]
+    series = [statistic_series(buffer, times, data) for buffer in stat_buffers]
+    summary = BackfillSummary(trigger_chains={trigger_state.name: 0 for trigger_state in state.trigger_states},
+                              chain_lengths={trigger_state.name: [] for trigger_state in state.trigger_states})
+    active = [trigger_state for trigger_state in state.trigger_states if trigger_state.trigger.active]
+    series_triggers = [trigger_state.trigger for trigger_state in active if _evaluates_series(trigger_state.trigger)]
+    frame_triggers = [trigger_state for trigger_state in active if not _evaluates_series(trigger_state.trigger)]
+
+    # What each buffer held after each frame: its whole series and its length after every frame
+    histories = {state.data_source: (times, data, ends)}
+    for stat_buffer, stat_series in zip(stat_buffers, series):
+        if stat_series is not None:
+            # One statistic value per frame, stamped with the newest point, as the live stat buffers do
+            histories[stat_buffer] = (times[ends - 1], stat_series[ends - 1], np.arange(1, ends.size + 1))
+
+    if frame_triggers or any(stat_series is None for stat_series in series):
+        calculated = {stat_buffer: ([], [], []) for stat_buffer in stat_buffers if stat_buffer not in histories}
+        start = 0
+        for end in ends.tolist():
+            state.data_source.append(times[start:end], data[start:end])
+            for stat_buffer in stat_buffers:
+                if stat_buffer in calculated:
+                    stat_times, stat_values, stat_ends = calculated[stat_buffer]
+                    if stat_buffer.fill_next_frame():
+                        stat_times.append(stat_buffer.time[-1])
+                        stat_values.append(stat_buffer.data[-1])
+                    stat_ends.append(len(stat_times))
+                else:
+                    stat_times, stat_values, stat_ends = histories[stat_buffer]
+                    stat_buffer.append(stat_times[summary.frames:summary.frames + 1],
+                                       stat_values[summary.frames:summary.frames + 1])
+
+            chain_status = [trigger_state.trigger.trigger_chain_status for trigger_state in frame_triggers]
+            state.run_triggers(frame_triggers)
+            for trigger_state, was_in_chain in zip(frame_triggers, chain_status):
+                in_chain = trigger_state.trigger.trigger_chain_status
+                if in_chain and not was_in_chain:
+                    summary.trigger_chains[trigger_state.name] += 1
+                    summary.chain_lengths[trigger_state.name].append(1)
+                elif in_chain:
+                    summary.chain_lengths[trigger_state.name][-1] += 1
+            summary.frames += 1
+            start = end
+        for stat_buffer, (stat_times, stat_values, stat_ends) in calculated.items():
+            histories[stat_buffer] = (np.array(stat_times, dtype=np.int64), np.array(stat_values, dtype=np.float64),
+                                      np.array(stat_ends, dtype=np.int64))
+    else:
+        # Nothing needs running frame by frame, the buffers just end up holding the tail of the history
+        state.data_source.append(times, data)
+        for stat_buffer in stat_buffers:
+            stat_times, stat_values, stat_ends = histories[stat_buffer]
+            stat_buffer.append(stat_times, stat_values)
+        summary.frames = int(ends.size)
+
+    for trigger in series_triggers:
+        _replay_series_trigger(trigger, *histories[trigger.buffer], summary)
+
+    summary.points = int(times.size)
+    summary.seconds = time.perf_counter() - started
+    return summary
+
+
+def run(save_file: str, frame_ms: float = BACKFILL_FRAME_MS, sample_period_ms: float = 1) -> BackfillSummary:
+    state = headless.load_state(save_file)
+    times, data = read_history(state.data_source, sample_period_ms=sample_period_ms)
+    return replay(state, times, data, frame_ms=frame_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a saved chart configuration over the whole of its data file, '
+                                                 'writing the same trigger output as a live run.')
+    parser.add_argument('save_file', help='Save file (json) holding the data source, statistics and triggers')
+    parser.add_argument('--frame-ms', type=float, default=BACKFILL_FRAME_MS,
+                        help='Data time covered by each simulated read of the data source')
+    parser.add_argument('--sample-period-ms', type=float, default=1,
+                        help='Time between points when the data file has no timestamp column')
+    args = parser.parse_args()
+    summary = run(args.save_file, frame_ms=args.frame_ms, sample_period_ms=args.sample_period_ms)
+    print(f'{summary.points} points in {summary.frames} frames processed in {summary.seconds:.2f}s')
+    for name, chains in summary.trigger_chains.items():
+        print(f'{name}: {chains} trigger chains')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import numpy as np
+
+# Western Electric and Nelson run rules for control charts. Each rule is evaluated over a whole window of data at
+# once; points are first reduced to zone masks (how many sigmas from the center line, and on which side) which are
+# shared by every rule, then runs and "k of n" counts are found with cumulative sums rather than Python loops.
+
+
+def _window_counts(mask: np.ndarray, window: int) -> np.ndarray:
+    # Number of True values in every run of `window` consecutive points
+    counts = np.concatenate(([0], np.cumsum(mask, dtype=np.int64)))
+    return counts[window:] - counts[:-window]
+
+
+def _windows_with_at_least(mask: np.ndarray, window: int, k: int) -> bool:
+    # True if any run of `window` consecutive points contains at least k True values
+    if mask.size < window:
+        return False
+    return bool(np.any(_window_counts(mask, window) >= k))
+
+
+def _run_of_at_least(mask: np.ndarray, n: int) -> bool:
+    return _windows_with_at_least(mask, n, n)
+
+
+class _Zones:
+    def __init__(self, data, center: float, sigma: float):
+        data = np.asarray(data, dtype=np.float64)
+        z_score = (data - center) / sigma if sigma > 0 else np.zeros_like(data)
+        self.data = data
+        self.above = z_score > 0
+        self.below = z_score < 0
+        self.beyond_1 = np.abs(z_score) > 1
+        self.beyond_2 = np.abs(z_score) > 2
+        self.beyond_3 = np.abs(z_score) > 3
+        self._diffs = None
+
+    @property
+    def diffs(self):
+        if self._diffs is None:
+            self._diffs = np.diff(self.data)
+        return self._diffs
+
+
+def _beyond_3_sigma(zones):
+    return bool(np.any(zones.beyond_3))
+
+
+def _same_side(n):
+    def rule(zones):
+        return _run_of_at_least(zones.above, n) or _run_of_at_least(zones.below, n)
+    return rule
+
+
+def _k_of_n_beyond(k, n, beyond_mask_name):
+    def rule(zones):
+        beyond = getattr(zones, beyond_mask_name)
+        return _windows_with_at_least(beyond & zones.above, n, k) or _windows_with_at_least(beyond & zones.below, n, k)
+    return rule
+
+
+def _trending(n):
+    # n points in a row steadily increasing or decreasing is n - 1 consecutive differences of the same sign
+    def rule(zones):
+        return _run_of_at_least(zones.diffs > 0, n - 1) or _run_of_at_least(zones.diffs < 0, n - 1)
+    return rule
+
+
+def _alternating(n):
+    # n points alternating up and down is n - 2 consecutive sign changes between differences
+    def rule(zones):
+        diffs = zones.diffs
+        return _run_of_at_least(diffs[:-1] * diffs[1:] < 0, n - 2)
+    return rule
+
+
+def _within_1_sigma(n):
+    def rule(zones):
+        return _run_of_at_least(~zones.beyond_1, n)
+    return rule
+
+
+def _none_within_1_sigma(n):
+    # Points on both sides of the center line, but none of them within one sigma
+    def rule(zones):
+        if zones.beyond_1.size < n:
+            return False
+        return bool(np.any((_window_counts(zones.beyond_1, n) == n) &
+                           (_window_counts(zones.beyond_1 & zones.above, n) > 0) &
+                           (_window_counts(zones.beyond_1 & zones.below, n) > 0)))
+    return rule
+
+
+RULES = {'western_electric_1': _beyond_3_sigma,
+         'western_electric_2': _k_of_n_beyond(2, 3, 'beyond_2'),
+         'western_electric_3': _k_of_n_beyond(4, 5, 'beyond_1'),
+         'western_electric_4': _same_side(8),
+         'nelson_1': _beyond_3_sigma,
+         'nelson_2': _same_side(9),
+         'nelson_3': _trending(6),
+         'nelson_4': _alternating(14),
+         'nelson_5': _k_of_n_beyond(2, 3, 'beyond_2'),
+         'nelson_6': _k_of_n_beyond(4, 5, 'beyond_1'),
+         'nelson_7': _within_1_sigma(15),
+         'nelson_8': _none_within_1_sigma(8)}
+
+WESTERN_ELECTRIC_RULES = tuple(name for name in RULES if name.startswith('western_electric'))
+NELSON_RULES = tuple(name for name in RULES if name.startswith('nelson'))
+
+
+def evaluate_rules(data, center: float, sigma: float, rules=NELSON_RULES) -> dict[str, bool]:
+    """Evaluates each named rule over data, returning {rule name: violated}"""
+    unknown = [name for name in rules if name not in RULES]
+    if unknown:
+        raise ValueError(f'Control chart rules {unknown} are not recognized')
+    zones = _Zones(data, center, sigma)
+    return {name: RULES[name](zones) for name in rules}
@@ -0,0 +1,61 @@
+import numpy as np
+
+
+def min_max_indices(y: np.ndarray, n_buckets: int) -> np.ndarray:
+    """Indices of the minimum and maximum of each of n_buckets equal sized buckets, in their original order.
+    Keeps every peak and trough visible while drawing at most 2 * n_buckets points."""
+    y = np.asarray(y)
+    if n_buckets < 1 or y.size <= 2 * n_buckets:
+        return np.arange(y.size)
+
+    bucket_size = y.size // n_buckets
+    bucketed = y[:n_buckets * bucket_size].reshape(n_buckets, bucket_size)
+    offsets = np.arange(n_buckets)[:, np.newaxis] * bucket_size
+    indices = np.sort(np.stack([np.argmin(bucketed, axis=1), np.argmax(bucketed, axis=1)], axis=1), axis=1) + offsets
+    indices = indices.ravel()
+
+    leftover = y[n_buckets * bucket_size:]
+    if leftover.size:
+        # The final partial bucket always includes the newest point so the line reaches the end of the data
+        leftover_start = n_buckets * bucket_size
+        extra = {leftover_start + int(np.argmin(leftover)), leftover_start + int(np.argmax(leftover)), y.size - 1}
+        indices = np.concatenate([indices, sorted(extra)])
+    return indices
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of n_out points that best preserve the visual shape of the line"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if n_out < 3 or x.size <= n_out:
+        return np.arange(x.size)
+
+    # First and last points are always kept, the rest are split into n_out - 2 buckets
+    edges = np.linspace(1, x.size - 1, n_out - 1).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = x.size - 1
+    selected = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < edges.size else x.size
+        # The third triangle point is the average of the following bucket
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        areas = np.abs((x[selected] - average_x) * (y[start:end] - y[selected])
+                       - (x[selected] - x[start:end]) * (average_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[i + 1] = selected
+    return indices
+
+
+def downsample_indices(x: np.ndarray, y: np.ndarray, n_out: int, method: str = 'min_max') -> np.ndarray:
+    match method:
+        case 'min_max':
+            return min_max_indices(y, n_out // 2)
+        case 'lttb':
+            return lttb_indices(x, y, n_out)
+        case None | 'none':
+            return np.arange(len(y))
+        case _:
+            raise ValueError(f'Downsampling method "{method}" is not recognized, use "min_max", "lttb" or "none"')
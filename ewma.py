@@ -24,7 +24,7 @@ def ewma_vectorized(data, alpha, offset=None, dtype=None, order='C', out=None):
         the same shape as the input. If not provided or `None`,
         a freshly-allocated array is returned.
     """
-    data = np.array(data, copy=False)
+    data = np.asarray(data)
 
     if dtype is None:
         if data.dtype == np.float32:
@@ -51,7 +51,7 @@ def ewma_vectorized(data, alpha, offset=None, dtype=None, order='C', out=None):
     if offset is None:
         offset = data[0]
 
-    alpha = np.array(alpha, copy=False).astype(dtype, copy=False)
+    alpha = np.asarray(alpha).astype(dtype, copy=False)
 
     # scaling_factors -> 0 as len(data) gets large
     # this leads to divide-by-zeros below
@@ -66,7 +66,7 @@ def ewma_vectorized(data, alpha, offset=None, dtype=None, order='C', out=None):
     out /= scaling_factors[-2::-1]
 
     if offset != 0:
-        offset = np.array(offset, copy=False).astype(dtype, copy=False)
+        offset = np.asarray(offset).astype(dtype, copy=False)
         # add offsets
         out += offset * scaling_factors[1:]
 
@@ -95,7 +95,7 @@ def ewma_vectorized_2d(data, alpha, axis=None, offset=None, dtype=None, order='C
         the same shape as the desired output. If not provided or `None`,
         a freshly-allocated array is returned.
     """
-    data = np.array(data, copy=False)
+    data = np.asarray(data)
 
     assert data.ndim <= 2
 
@@ -142,7 +142,7 @@ def ewma_vectorized_2d(data, alpha, axis=None, offset=None, dtype=None, order='C
     elif np.size(offset) == 1:
         offset = np.reshape(offset, (1,))
 
-    alpha = np.array(alpha, copy=False).astype(dtype, copy=False)
+    alpha = np.asarray(alpha).astype(dtype, copy=False)
 
     # calculate the moving average
     row_size = data.shape[1]
@@ -191,13 +191,13 @@ def ewma_vectorized_safe(data, alpha, row_size=None, dtype=None, order='C', out=
         a freshly-allocated array is returned.
     :return: The flattened result.
     """
-    data = np.array(data, copy=False)
+    data = np.asarray(data)
 
     if dtype is None:
         if data.dtype == np.float32:
             dtype = np.float32
         else:
-            dtype = np.float
+            dtype = np.float64
     else:
         dtype = np.dtype(dtype)
 
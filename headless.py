@@ -0,0 +1,85 @@
+import argparse
+import sys
+import time
+import State
+import Engine
+
+
+def load_state(save_file: str) -> State.State:
+    state = State.State()
+    state.open_save_file(save_file)
+    state.populate_state_from_reference()
+    return state
+
+
+def run(save_file: str, period_ms: float = Engine.INGESTION_PERIOD_MS, duration: float = None):
+    # Ingestion, statistics and triggers (including their file output) run exactly as in the GUI, minus the plotting
+    engine = Engine.IngestionEngine(load_state(save_file), period_ms=period_ms)
+    engine.start()
+    try:
+        if duration is not None:
+            time.sleep(duration)
+        else:
+            while engine.running:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop()
+    if engine.error is not None:
+        raise RuntimeError(f'Ingestion of "{save_file}" stopped: {engine.error}') from engine.error
+    return engine.state
+
+
+def run_many(save_files: list[str], period_ms: float = Engine.INGESTION_PERIOD_MS, duration: float = None,
+             max_workers: int = None, processes: bool = False):
+    # Worker processes rather than threads let charts with Python heavy statistics or triggers use every core
+    engine_type = Engine.ProcessChartEngine if processes else Engine.MultiChartEngine
+    engine = engine_type(period_ms=period_ms, max_workers=max_workers)
+    for save_file in save_files:
+        engine.add_save_file(save_file)
+    engine.start()
+    try:
+        if duration is not None:
+            time.sleep(duration)
+        else:
+            while engine.running:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop()
+    return engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a saved chart configuration without the GUI, '
+                                                 'writing trigger output as it happens.')
+    parser.add_argument('save_files', nargs='+',
+                        help='Save files (json) holding the data source, statistics and triggers, one per chart')
+    parser.add_argument('--period-ms', type=float, default=Engine.INGESTION_PERIOD_MS,
+                        help='Milliseconds between reads of the data source')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='Seconds to run for, runs until interrupted if not given')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker threads shared by the charts when more than one save file is given')
+    parser.add_argument('--processes', action='store_true',
+                        help='Spread the charts over --workers processes instead of threads')
+    args = parser.parse_args()
+    if len(args.save_files) == 1:
+        try:
+            run(args.save_files[0], period_ms=args.period_ms, duration=args.duration)
+        except RuntimeError as e:
+            sys.exit(str(e))
+        return
+    engine = run_many(args.save_files, period_ms=args.period_ms, duration=args.duration, max_workers=args.workers,
+                      processes=args.processes)
+    for name, stats in engine.stats.items():
+        print(f'{name}: {stats.points} points in {stats.frames} frames, {stats.cpu_seconds:.3f}s CPU'
+              + (f', stopped by {stats.error}' if stats.error is not None else ''))
+    if len(engine.stats) < len(args.save_files) or any(stats.error is not None for stats in engine.stats.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,16 @@
 import State
+import Engine
+import Buffer
+import downsample
 from GUI_Windows import DataManagementWindow, SettingsWindows, StatisticsWindow, TriggerWindow
 
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox
+import numpy as np
 from matplotlib import pyplot as plt
 import matplotlib.animation as animation
+import matplotlib.dates as mdates
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import customtkinter as ctk
 
@@ -14,6 +19,7 @@ class App(ctk.CTk):
     def __init__(self, state: State.State):
         super().__init__()
         self.data_state = state
+        self.engine = Engine.IngestionEngine(state)
         self.plotting_active = False
         self.animation_interval = 100
         self.plot_raw_time_values = False
@@ -21,6 +27,14 @@ class App(ctk.CTk):
         self.show_stats_legend = True
         self.data_legend_location = 'lower right'
         self.stat_legend_location = 'lower right'
+        # Series are reduced to about one point per horizontal pixel before drawing ('min_max', 'lttb' or 'none')
+        self.downsample_method = 'min_max'
+        # Line artists are created once per chart configuration and only have their data replaced each frame
+        self.artist_signature = None
+        self.data_line = None
+        self.central_stat_line = None
+        self.spread_stat_line = None
+        self.trigger_lines = []
 
         # Setup window
         self.title('Statistical Process Charts')
@@ -54,6 +68,8 @@ class App(ctk.CTk):
             case _:
                 axis = ax_central_stat
         axis.set_ylim(limits)
+        # Axis limits live in the blitting background, so it has to be redrawn in full
+        fig.canvas.draw()
 
     @staticmethod
     def reset_chart_ylims(axis_type: str):
@@ -66,81 +82,125 @@ class App(ctk.CTk):
                 axis = ax_spread_stat
             case _:
                 axis = ax_central_stat
+        axis.set_autoscaley_on(True)
         axis.relim()
         axis.autoscale_view()
+        fig.canvas.draw()
 
-    def _plot_data_source(self):
-        # Plot the data source
-        if self.data_state.data_source is not None:
-            self.data_state.data_source.fill_next_frame()
-            ax_data.cla()
-            if self.plot_raw_time_values:
-                ax_data.plot(self.data_state.data_source.time, self.data_state.data_source.data,
-                             label=self.data_state.data_source.name)
-            else:
-                # fmt is needed for plot_date b/c it defaults to a scatter plot
-                ax_data.plot_date(self.data_state.data_source.timestamps, self.data_state.data_source.data,
-                                  fmt='-', label=self.data_state.data_source.name)
-
-    def _plot_central_location_statistic(self):
-        # Plotting the central location statistic
-        if self.data_state.central_location_statistic is not None:
-            self.data_state.central_location_statistic.fill_next_frame()
-            ax_central_stat.cla()
-            if self.plot_raw_time_values:
-                ax_central_stat.plot(self.data_state.central_location_statistic.time,
-                                     self.data_state.central_location_statistic.data,
-                                     label=self.data_state.central_location_statistic.name)
-            else:
-                ax_central_stat.plot_date(self.data_state.central_location_statistic.timestamps,
-                                          self.data_state.central_location_statistic.data,
-                                          fmt='-', label=self.data_state.central_location_statistic.name)
-            ax_central_stat.set_ylabel(str(self.data_state.central_location_statistic.name))
-
-    def _plot_spread_statistic(self):
-        # Plotting the spread statistic
-        if self.data_state.spread_statistic is not None:
-            self.data_state.spread_statistic.fill_next_frame()
-            ax_spread_stat.cla()
-            if self.plot_raw_time_values:
-                ax_spread_stat.plot(self.data_state.spread_statistic.time,
-                                    self.data_state.spread_statistic.data,
-                                    label=self.data_state.spread_statistic.name)
+    def _x_values(self, times, time_unit):
+        if self.plot_raw_time_values:
+            return np.asarray(times)
+        return mdates.date2num(Buffer.to_datetime64(times, time_unit))
+
+    @staticmethod
+    def _trigger_axis(source: str):
+        match source:
+            case "Data":
+                return ax_data
+            case "CentralLocationStatistic":
+                return ax_central_stat
+            case "SpreadStatistic":
+                return ax_spread_stat
+            case _:
+                return ax_central_stat
+
+    def _get_artist_signature(self, snapshot):
+        buffer_names = tuple(buffer.name if buffer is not None else None for buffer in
+                             (snapshot.data_source, snapshot.central_location_statistic, snapshot.spread_statistic))
+        trigger_names = tuple((trigger_plot.name, trigger_plot.source) for trigger_plot in snapshot.trigger_plots)
+        return (buffer_names, trigger_names, self.plot_raw_time_values, self.show_data_legend, self.show_stats_legend,
+                self.data_legend_location, self.stat_legend_location)
+
+    def _build_artists(self, snapshot):
+        ax_data.cla()
+        ax_central_stat.cla()
+        ax_spread_stat.cla()
+        self.data_line = self.central_stat_line = self.spread_stat_line = None
+
+        if snapshot.data_source is not None:
+            self.data_line, = ax_data.plot([], [], '-', label=snapshot.data_source.name, animated=True)
+        if snapshot.central_location_statistic is not None:
+            self.central_stat_line, = ax_central_stat.plot([], [], '-', animated=True,
+                                                           label=snapshot.central_location_statistic.name)
+            ax_central_stat.set_ylabel(str(snapshot.central_location_statistic.name))
+        if snapshot.spread_statistic is not None:
+            self.spread_stat_line, = ax_spread_stat.plot([], [], 'm-', label=snapshot.spread_statistic.name,
+                                                         animated=True)
+            ax_spread_stat.set_ylabel(str(snapshot.spread_statistic.name))
+        self.trigger_lines = [self._trigger_axis(trigger_plot.source).plot([], [], 'r-', linewidth=2, animated=True,
+                                                                           label=trigger_plot.name)[0]
+                              for trigger_plot in snapshot.trigger_plots]
+
+        if not self.plot_raw_time_values:
+            for axis in (ax_data, ax_central_stat, ax_spread_stat):
+                axis.xaxis_date()
+
+        self._plot_data_legends()
+        self._plot_stat_legends()
+        self.artist_signature = self._get_artist_signature(snapshot)
+        fig.canvas.draw()
+
+    def _update_artist_data(self, snapshot):
+        for line, buffer in ((self.data_line, snapshot.data_source),
+                             (self.central_stat_line, snapshot.central_location_statistic),
+                             (self.spread_stat_line, snapshot.spread_statistic)):
+            if line is not None:
+                # Decimate on the raw times so only the points that will be drawn need converting to dates
+                pixel_width = max(int(line.axes.bbox.width), 1)
+                indices = downsample.downsample_indices(buffer.time, buffer.data, pixel_width,
+                                                        method=self.downsample_method)
+                line.set_data(self._x_values(buffer.time[indices], buffer.time_unit), buffer.data[indices])
+
+        for line, trigger_plot_snapshot in zip(self.trigger_lines, snapshot.trigger_plots):
+            # Every plot of a trigger shares one line, with NaN gaps between the separate trigger chains
+            x_values, y_values = [], []
+            for trigger_plot in trigger_plot_snapshot.plots:
+                x_values += [self._x_values(trigger_plot.time, trigger_plot.time_unit), [np.nan]]
+                y_values += [np.asarray(trigger_plot.data, dtype=float), [np.nan]]
+            if x_values:
+                line.set_data(np.concatenate(x_values), np.concatenate(y_values))
             else:
-                ax_spread_stat.plot_date(self.data_state.spread_statistic.timestamps,
-                                         self.data_state.spread_statistic.data,
-                                         fmt='m-', label=self.data_state.spread_statistic.name)
-            ax_spread_stat.set_ylabel(str(self.data_state.spread_statistic.name))
-
-    def _plot_triggers(self):
-        if self.data_state.trigger_states:
-            for trigger_state in self.data_state.trigger_states:
-                trigger = trigger_state.trigger
-
-                if trigger.active:
-                    if trigger.run():
-                        trigger_state.plots.add_trigger_plot(trigger)
-
-                    match trigger.source:
-                        case "Data":
-                            plot_axis = ax_data
-                        case "CentralLocationStatistic":
-                            plot_axis = ax_central_stat
-                        case "SpreadStatistic":
-                            plot_axis = ax_spread_stat
-                        case _:
-                            plot_axis = "CentralLocationStatistic"
-
-                    if trigger_state.plots:
-                        # Remove old plots
-                        trigger_state.plots.remove_old_plot_data(old_time=self.data_state.data_source.time[0])
-                        for trigger_plot in trigger_state.plots:
-                            if self.plot_raw_time_values:
-                                plot_axis.plot(trigger_plot.time, trigger_plot.data, fmt='r-',
-                                               linewidth=2, label=trigger.name)
-                            else:
-                                plot_axis.plot_date(trigger_plot.timestamps, trigger_plot.data,
-                                                    fmt='r-', linewidth=2, label=trigger.name)
+                line.set_data([], [])
+
+    @staticmethod
+    def _value_range(arrays):
+        ranges = [(np.nanmin(a), np.nanmax(a)) for a in arrays if len(a) and not np.all(np.isnan(a))]
+        if not ranges:
+            return None
+        return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+    @staticmethod
+    def _new_limits(current, value_range, headroom=0.1):
+        # Limits are given headroom so they only move every so often, every move costs a full (non blitted) redraw
+        low, high = value_range
+        current_low, current_high = current
+        if current_low <= low and high <= current_high and (high - low) >= 0.5 * (current_high - current_low):
+            return None
+        span = high - low if high > low else 1.0
+        return low - headroom * span, high + headroom * span
+
+    def _rescale_axes(self):
+        changed = False
+        for axes in ((ax_data,), (ax_central_stat, ax_spread_stat)):
+            # Twin axes share the x-axis so their x range is taken together
+            x_range = self._value_range([line.get_xdata() for axis in axes for line in axis.get_lines()])
+            if x_range is not None and axes[0].get_autoscalex_on():
+                new_limits = self._new_limits(axes[0].get_xlim(), x_range)
+                if new_limits is not None:
+                    axes[0].set_xlim(new_limits, auto=True)
+                    changed = True
+            for axis in axes:
+                y_range = self._value_range([line.get_ydata() for line in axis.get_lines()])
+                if y_range is not None and axis.get_autoscaley_on():
+                    new_limits = self._new_limits(axis.get_ylim(), y_range)
+                    if new_limits is not None:
+                        axis.set_ylim(new_limits, auto=True)
+                        changed = True
+        return changed
+
+    def _animated_artists(self):
+        return [line for line in (self.data_line, self.central_stat_line, self.spread_stat_line) if line is not None]\
+            + self.trigger_lines
 
     def _plot_stat_legends(self):
         if self.show_stats_legend:
@@ -191,32 +251,41 @@ class App(ctk.CTk):
 
     def animate(self, i):
         if not self.plotting_active:
-            # # Plot the origin to ensure graph is populated and sized appropriately
-            ax_data.cla()
-            ax_central_stat.cla()
-            ax_spread_stat.cla()
-            ax_data.plot([0], [0])
-            ax_central_stat.plot([0], [0])
-            ax_spread_stat.plot([0], [0])
-        else:
-            self._plot_data_source()
-            self._plot_central_location_statistic()
-            self._plot_spread_statistic()
-            self._plot_triggers()
-            self._plot_data_legends()
-            self._plot_stat_legends()
+            return []
+
+        if self.engine.error is not None:
+            error, self.engine.error = self.engine.error, None
+            self.plotting_active = False
+            messagebox.showwarning(title="Failure", message=f'Reading the data stopped with an error: {error}\n'
+                                                            'Correct the data source and start the chart again.')
+            return []
+
+        snapshot = self.engine.snapshot()
+        if self._get_artist_signature(snapshot) != self.artist_signature:
+            self._build_artists(snapshot)
+        self._update_artist_data(snapshot)
+        if self._rescale_axes():
+            # Refresh the ticks and background that blitting restores each frame
+            fig.canvas.draw()
         self.update()
+        return self._animated_artists()
 
     def stop_animation(self):
         if ani:
             ani.pause()
+            self.engine.stop()
             self.clear_all_data()
             ax_data.cla()
             ax_central_stat.cla()
             ax_spread_stat.cla()
+            self.artist_signature = None
+            self.data_line = self.central_stat_line = self.spread_stat_line = None
+            self.trigger_lines = []
+            fig.canvas.draw()
 
     def start_animation(self):
         self.plotting_active = True
+        self.engine.start()
         ani.resume()
         messagebox.showinfo(title="Success", message="Chart resumed")
 
@@ -266,8 +335,9 @@ class AppMenu(tk.Menu):
         if not f or f is None:
             return
 
-        self.root.data_state.open_save_file(f)
-        self.root.data_state.populate_state_from_reference()
+        with self.root.engine.lock:
+            self.root.data_state.open_save_file(f)
+            self.root.data_state.populate_state_from_reference()
 
     def save_file(self):
         f = filedialog.asksaveasfilename(filetypes=(("JSON files", "*.json*"), ("all files", "*.*")),
@@ -326,7 +396,8 @@ app.option_add('*tearOff', False)
 ax_data = plt.subplot(121)
 ax_central_stat = plt.subplot(122)
 ax_spread_stat = ax_central_stat.twinx()
-ani = animation.FuncAnimation(fig, app.animate, interval=app.animation_interval, blit=False)
+ani = animation.FuncAnimation(fig, app.animate, interval=app.animation_interval, blit=True,
+                              cache_frame_data=False)
 ani.pause()
 
 app.mainloop()
@@ -1,95 +1,481 @@
+import heapq
+import math
+from collections import Counter
 import numpy as np
+import Archive
 import Buffer
 import functools
 import ewma
-import scipy
 
 
 def simple_average(data: Buffer.Buffer, size, size_type):
     return np.mean(data.data)
 
 
-def simple_moving_average(data: Buffer.Buffer, size, size_type='ms'):
-    if len(data) == 1:
-        return np.mean(data.tail_data(1))
+class SlidingWindow:
+    """Tracks which points of a buffer enter and leave a trailing count or time window between updates.
 
-    if size_type == 'count':
-        if len(data) < size:
-            return np.mean(data.data)
-        else:
-            return np.mean(data.tail_data(size))
-    elif size_type in ('ms', 's'):
-        return np.mean(data.tail_data_by_time_duration(size))
+    Window bounds are absolute point indexes (see Buffer.total_points) so they survive the buffer's storage moving.
+    Points the buffer evicts while still inside the window are kept until the next update, so a window as long as the
+    buffer itself can still be updated incrementally.
+    """
+    def __init__(self, data_buffer: Buffer.Buffer, size, size_type='ms'):
+        self.data_buffer = data_buffer
+        self.size = size
+        self.size_type = size_type
+        self.start = None
+        self.end = None
+        self._evicted = []
+        data_buffer.on_evict(self._keep_evicted)
 
+    def _keep_evicted(self, first_index: int, data: np.ndarray):
+        if self.start is None or first_index + data.size <= self.start:
+            return
+        self._evicted.append(data[max(self.start - first_index, 0):].copy())
 
-def exponentially_weighed_moving_average(data: Buffer.Buffer, size, size_type='ms', alpha=0.01):
-    if len(data) == 1:
-        return data.tail_data(1)
-    if size_type == 'count':
-        if len(data) < size:
-            return ewma.ewma_vectorized_safe(data.data, alpha=alpha)
-        else:
-            return ewma.ewma_vectorized_safe(data.tail_data(size), alpha=alpha)
-    elif size_type in ('ms', 's'):
-        return ewma.ewma_vectorized_safe(data.tail_data_by_time_duration(size), alpha=alpha)
+    def _oldest_index(self):
+        return self.data_buffer.total_points - len(self.data_buffer)
 
+    def _current_start(self):
+        if self.size_type in ('ms', 's'):
+            return self._oldest_index() + self.data_buffer.window_start_index(self.size)
+        return max(self._oldest_index(), self.data_buffer.total_points - int(self.size))
 
-def std_dev(data: Buffer.Buffer, size, size_type='ms'):
-    if len(data) == 1:
-        return np.std(data.tail_data(1))
+    def window_data(self) -> np.ndarray:
+        return self.data_buffer.data[self.start - self._oldest_index():]
 
-    if size_type == 'count':
-        if len(data) < size:
-            return np.std(data.data)
-        else:
-            return np.std(data.tail_data(size))
-    elif size_type in ('ms', 's'):
-        return np.std(data.tail_data_by_time_duration(size))
+    def advance(self):
+        """Moves the window to the newest data and returns the (entering, leaving) points.
+        Returns None when the window can not be updated incrementally and has to be rebuilt from window_data()."""
+        oldest = self._oldest_index()
+        new_start, new_end = self._current_start(), self.data_buffer.total_points
+        evicted = np.concatenate(self._evicted) if self._evicted else np.empty(0)
+        self._evicted = []
+        # Any of the window's points that are no longer in the buffer must all have been kept when evicted
+        incremental = (self.start is not None and self.start <= new_start <= self.end and self.end >= oldest and
+                       self.start + evicted.size == max(self.start, oldest))
+        if incremental:
+            data = self.data_buffer.data
+            entering = data[self.end - oldest:new_end - oldest]
+            leaving = data[max(self.start, oldest) - oldest:new_start - oldest]
+            if evicted.size:
+                leaving = np.concatenate((evicted, leaving))
+        self.start, self.end = new_start, new_end
+        return (entering, leaving) if incremental else None
 
 
-def variance(data: Buffer.Buffer, size, size_type='ms'):
-    if len(data) == 1:
-        return np.var(data.tail_data(1))
+class RollingMoments:
+    """Count, mean and sum of squared deviations of a sliding window, updated in O(1) per point.
+
+    Points are merged in and out in batches with Chan et al.'s pairwise form of Welford's method. Removal slowly
+    accumulates rounding error, so the moments are re-summed from the window once per full turnover of its points.
+    The sum of logs is only kept once a statistic requires it.
+    """
+    def __init__(self, window: SlidingWindow):
+        self.window = window
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.log_sum = 0.0
+        self.track_log_sum = False
+        self._removed_since_resum = 0
+        self._points_seen = None
+
+    def require(self, moments: tuple):
+        if 'log_sum' in moments and not self.track_log_sum:
+            self.track_log_sum = True
+            # Rebuilt from the window on the next update
+            self._points_seen = None
+
+    def update(self):
+        # Shared moments are updated once per data frame however many statistics read them
+        if self._points_seen == self.window.data_buffer.total_points:
+            return
+        rebuild = self._points_seen is None
+        self._points_seen = self.window.data_buffer.total_points
+        change = self.window.advance()
+        if change is None or rebuild:
+            self._resum()
+            return
+        entering, leaving = change
+        self._remove(leaving)
+        self._add(entering)
+        self._removed_since_resum += leaving.size
+        if self._removed_since_resum >= max(self.count, 1):
+            self._resum()
+
+    def _resum(self):
+        values = self.window.window_data()
+        self.count = values.size
+        self.mean = float(np.mean(values)) if values.size else 0.0
+        self.m2 = float(np.sum(np.square(values - self.mean))) if values.size else 0.0
+        self.log_sum = float(np.sum(np.log(values))) if self.track_log_sum and values.size else 0.0
+        self._removed_since_resum = 0
+
+    def _add(self, values: np.ndarray):
+        if values.size == 0:
+            return
+        batch_count = values.size
+        batch_mean = float(np.mean(values))
+        batch_m2 = float(np.sum(np.square(values - batch_mean)))
+        new_count = self.count + batch_count
+        delta = batch_mean - self.mean
+        self.mean += delta * batch_count / new_count
+        self.m2 += batch_m2 + delta * delta * self.count * batch_count / new_count
+        self.count = new_count
+        if self.track_log_sum:
+            self.log_sum += float(np.sum(np.log(values)))
+
+    def _remove(self, values: np.ndarray):
+        if values.size == 0:
+            return
+        batch_count = values.size
+        remaining_count = self.count - batch_count
+        if remaining_count <= 0:
+            self.count, self.mean, self.m2, self.log_sum = 0, 0.0, 0.0, 0.0
+            return
+        batch_mean = float(np.mean(values))
+        batch_m2 = float(np.sum(np.square(values - batch_mean)))
+        remaining_mean = (self.count * self.mean - batch_count * batch_mean) / remaining_count
+        delta = batch_mean - remaining_mean
+        self.m2 = max(self.m2 - batch_m2 - delta * delta * remaining_count * batch_count / self.count, 0.0)
+        self.mean = remaining_mean
+        self.count = remaining_count
+        if self.track_log_sum:
+            self.log_sum -= float(np.sum(np.log(values)))
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.0
+
+
+def shared_moments(data: Buffer.Buffer, size, size_type='ms', required: tuple = ()) -> RollingMoments:
+    # Moments shared by every statistic over the same data buffer and window, so each data frame is only folded in once
+    windows = data.shared_moments
+    key = (size, size_type if size_type in ('ms', 's') else 'count')
+    if key not in windows:
+        windows[key] = RollingMoments(SlidingWindow(data, size, size_type))
+    moments = windows[key]
+    moments.require(required)
+    return moments
+
+
+class RollingStatistic:
+    """Base for statistics that keep rolling state between calls instead of recalculating the whole window.
+    Subclasses declare the moments they read in required_moments."""
+    required_moments = ('count', 'mean', 'm2')
+
+    def __init__(self, data: Buffer.Buffer, size, size_type='ms'):
+        self.moments = shared_moments(data, size, size_type, required=self.required_moments)
+
+    def __call__(self):
+        self.moments.update()
+        return self.value()
+
+    def value(self):
+        raise NotImplementedError
 
-    if size_type == 'count':
-        if len(data) < size:
-            return np.var(data.data)
-        else:
-            return np.var(data.tail_data(size))
-    elif size_type in ('ms', 's'):
-        return np.var(data.tail_data_by_time_duration(size))
 
+class RollingMean(RollingStatistic):
+    def value(self):
+        return self.moments.mean
 
-def geometric_mean(data: Buffer.Buffer, size, size_type='ms'):
-    if len(data) == 1:
-        return scipy.stats.mstats.gmean(data.tail_data(1), nan_policy='omit')
 
-    if size_type == 'count':
-        if len(data) < size:
-            return scipy.stats.mstats.gmean(data.data, nan_policy='omit')
+class RollingVariance(RollingStatistic):
+    def value(self):
+        return self.moments.variance
+
+
+class RollingStdDev(RollingStatistic):
+    def value(self):
+        return np.sqrt(self.moments.variance)
+
+
+class RollingGeometricMean(RollingStatistic):
+    required_moments = ('count', 'log_sum')
+
+    def value(self):
+        return np.exp(self.moments.log_sum / self.moments.count) if self.moments.count else 0.0
+
+
+class QuantileHeaps:
+    """Running quantile of a multiset of values, split into a max-heap of the lower values and a min-heap of the upper.
+
+    Values are removed lazily: they are counted as deleted and only popped once they reach the top of their heap, so
+    adding or removing a value costs O(log n). Deleted values that never reach the top (e.g. the old values of trending
+    data) are cleared out by rebuilding the heaps once they hold twice as many values as are live. The quantile is interpolated linearly between the closest ranks, as
+    np.quantile does by default.
+    """
+    def __init__(self, quantile: float = 0.5):
+        if not 0 <= quantile <= 1:
+            raise ValueError(f'Quantile must be between 0 and 1, got {quantile}')
+        self.quantile = quantile
+        self._lower = []  # Negated so the largest lower value is on top
+        self._upper = []
+        self._lower_size = 0
+        self._upper_size = 0
+        self._deleted = Counter()
+
+    def __len__(self):
+        return self._lower_size + self._upper_size
+
+    def clear(self):
+        self.__init__(self.quantile)
+
+    def _prune(self, heap: list, sign: int):
+        while heap and self._deleted[sign * heap[0]]:
+            value = sign * heapq.heappop(heap)
+            self._deleted[value] -= 1
+            if not self._deleted[value]:
+                del self._deleted[value]
+
+    def _compact(self):
+        values = []
+        for value in sorted([-value for value in self._lower] + self._upper):
+            if self._deleted[value]:
+                self._deleted[value] -= 1
+            else:
+                values.append(value)
+        self._deleted = Counter()
+        # Sorted lists are already heaps
+        self._lower = [-value for value in reversed(values[:self._lower_size])]
+        self._upper = values[self._lower_size:]
+
+    def _rebalance(self):
+        count = len(self)
+        # The lower heap holds every rank up to and including the one the quantile falls on or just after
+        target = math.floor(self.quantile * (count - 1)) + 1 if count else 0
+        while self._lower_size > target:
+            heapq.heappush(self._upper, -heapq.heappop(self._lower))
+            self._lower_size -= 1
+            self._upper_size += 1
+            self._prune(self._lower, -1)
+        while self._lower_size < target:
+            heapq.heappush(self._lower, -heapq.heappop(self._upper))
+            self._upper_size -= 1
+            self._lower_size += 1
+            self._prune(self._upper, 1)
+
+    def add(self, value: float):
+        if self._lower_size and value <= -self._lower[0]:
+            heapq.heappush(self._lower, -value)
+            self._lower_size += 1
         else:
-            return scipy.stats.mstats.gmean(data.tail_data(size), nan_policy='omit')
-    elif size_type in ('ms', 's'):
-        return scipy.stats.mstats.gmean(data.tail_data_by_time_duration(size), nan_policy='omit')
+            heapq.heappush(self._upper, value)
+            self._upper_size += 1
+        self._rebalance()
+
+    def remove(self, value: float):
+        self._deleted[value] += 1
+        if self._lower_size and value <= -self._lower[0]:
+            self._lower_size -= 1
+            self._prune(self._lower, -1)
+        else:
+            self._upper_size -= 1
+            self._prune(self._upper, 1)
+        self._rebalance()
+        if len(self._lower) + len(self._upper) > 2 * max(len(self), 8):
+            self._compact()
+
+    def value(self) -> float:
+        count = len(self)
+        if not count:
+            return np.nan
+        position = self.quantile * (count - 1)
+        fraction = position - math.floor(position)
+        lower = -self._lower[0]
+        if fraction and self._upper_size:
+            return lower + fraction * (self._upper[0] - lower)
+        return lower
+
 
+class RollingOrderStatistic:
+    """Base for statistics built on running quantiles of a sliding window, updated per point in O(log n)"""
+    quantiles = (0.5,)
 
-central_location_statistic_function_map = {'simple_moving_average': simple_moving_average,
-                                           'exponentially_weighed_moving_average': exponentially_weighed_moving_average}
+    def __init__(self, data: Buffer.Buffer, size, size_type='ms'):
+        self.window = SlidingWindow(data, size, size_type)
+        self.heaps = [QuantileHeaps(quantile) for quantile in self.quantiles]
+
+    def __call__(self):
+        change = self.window.advance()
+        for heaps in self.heaps:
+            if change is None:
+                heaps.clear()
+                entering, leaving = self.window.window_data(), ()
+            else:
+                entering, leaving = change
+            for value in np.asarray(leaving).tolist():
+                heaps.remove(value)
+            for value in entering.tolist():
+                heaps.add(value)
+        return self.value()
+
+    def value(self):
+        raise NotImplementedError
+
+
+class RollingQuantile(RollingOrderStatistic):
+    def __init__(self, data: Buffer.Buffer, size, size_type='ms', quantile=0.5):
+        self.quantiles = (quantile,)
+        super().__init__(data, size, size_type)
+
+    def value(self):
+        return self.heaps[0].value()
+
+
+class RollingMedian(RollingOrderStatistic):
+    def value(self):
+        return self.heaps[0].value()
+
+
+class RollingInterquartileRange(RollingOrderStatistic):
+    quantiles = (0.25, 0.75)
+
+    def value(self):
+        return self.heaps[1].value() - self.heaps[0].value()
+
+
+class ExponentiallyWeightedMovingAverage:
+    """EWMA that carries its smoothed value between calls so each new point costs O(1).
+
+    The first call (or a call after points were lost from the data buffer or it was cleared) initializes from the trailing window of
+    history with the vectorized implementation; from then on only the points added since the last call are folded in.
+    """
+    def __init__(self, data: Buffer.Buffer, size, size_type='ms', alpha=0.01):
+        self.data = data
+        self.size = size
+        self.size_type = size_type
+        self.alpha = alpha
+        self.max_row_size = ewma.get_max_row_size(alpha)
+        self.value = None
+        self._points_seen = 0
+        self._generation = data.generation
+
+    def _history(self):
+        if self.size_type in ('ms', 's'):
+            return self.data.tail_data_by_time_duration(self.size)
+        return self.data.tail_data(self.size)
+
+    def _fold_in(self, new_data: np.ndarray):
+        if new_data.size == 1:
+            return (1 - self.alpha) * self.value + self.alpha * float(new_data[0])
+        if new_data.size <= self.max_row_size:
+            return float(ewma.ewma_vectorized(new_data, alpha=self.alpha, offset=self.value)[-1])
+        # The safe version always starts from new_data[0]; shift its result onto the running value instead
+        restarted = ewma.ewma_vectorized_safe(new_data, alpha=self.alpha, row_size=self.max_row_size)[-1]
+        return float(restarted + (self.value - new_data[0]) * (1 - self.alpha) ** new_data.size)
+
+    def __call__(self):
+        oldest = self.data.total_points - len(self.data)
+        if self.value is None or self._points_seen < oldest or self._generation != self.data.generation:
+            self._generation = self.data.generation
+            self.value = float(ewma.ewma_vectorized_safe(self._history(), alpha=self.alpha,
+                                                         row_size=self.max_row_size)[-1])
+        elif self._points_seen < self.data.total_points:
+            self.value = self._fold_in(self.data.data[self._points_seen - oldest:])
+        self._points_seen = self.data.total_points
+        return self.value
+
+
+def window_start_indices(times: np.ndarray, size, size_type='ms', capacity=None, capacity_type='ms') -> np.ndarray:
+    """Start index of the trailing window ending at every point of a whole series, matching what SlidingWindow gives
+    when the point is the newest in a buffer of the given capacity"""
+    ends = np.arange(times.size)
+    if capacity is None:
+        oldest = np.zeros(times.size, dtype=np.int64)
+    elif capacity_type in ('ms', 's'):
+        oldest = np.searchsorted(times, times - capacity, side='right')
+    else:
+        oldest = np.maximum(ends + 1 - int(capacity), 0)
+    if size_type in ('ms', 's'):
+        # As with Buffer.window_start_index the newest point older than the window is kept
+        return np.maximum(np.searchsorted(times, times - size, side='left') - 1, oldest)
+    return np.maximum(ends + 1 - int(size), oldest)
+
+
+def _window_sums(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    return cumulative[1:] - cumulative[starts]
+
+
+def moving_average_series(data: np.ndarray, starts: np.ndarray, **kwargs) -> np.ndarray:
+    counts = np.arange(1, data.size + 1) - starts
+    return _window_sums(data, starts) / counts
+
+
+def variance_series(data: np.ndarray, starts: np.ndarray, **kwargs) -> np.ndarray:
+    counts = np.arange(1, data.size + 1) - starts
+    # Shifting by the series mean keeps the sum of squares from swamping the variance for data far from zero
+    shifted = data - np.mean(data) if data.size else data
+    means = _window_sums(shifted, starts) / counts
+    return np.maximum(_window_sums(np.square(shifted), starts) / counts - np.square(means), 0.0)
+
+
+def std_dev_series(data: np.ndarray, starts: np.ndarray, **kwargs) -> np.ndarray:
+    return np.sqrt(variance_series(data, starts))
+
+
+def window_extremes_series(data: np.ndarray, starts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Max and min of every window from a sparse table, each window being covered by two overlapping power of two spans
+    ends = np.arange(1, data.size + 1)
+    spans = np.frexp(np.maximum(ends - starts, 1))[1] - 1
+    maxima, minima = np.empty(data.size), np.empty(data.size)
+    level_max, level_min = data, data
+    for level in range(int(spans.max(initial=0)) + 1):
+        if level:
+            step = 1 << (level - 1)
+            level_max = np.maximum(level_max[:-step], level_max[step:])
+            level_min = np.minimum(level_min[:-step], level_min[step:])
+        at_level = np.flatnonzero(spans == level)
+        first, second = starts[at_level], ends[at_level] - (1 << level)
+        maxima[at_level] = np.maximum(level_max[first], level_max[second])
+        minima[at_level] = np.minimum(level_min[first], level_min[second])
+    return maxima, minima
+
+
+def geometric_mean_series(data: np.ndarray, starts: np.ndarray, **kwargs) -> np.ndarray:
+    counts = np.arange(1, data.size + 1) - starts
+    return np.exp(_window_sums(np.log(data), starts) / counts)
+
+
+def ewma_series(data: np.ndarray, starts: np.ndarray, alpha=0.01, **kwargs) -> np.ndarray:
+    # The rolling EWMA carries its value from the first point onwards, so the window starts do not apply
+    return ewma.ewma_vectorized_safe(data, alpha=alpha, row_size=ewma.get_max_row_size(alpha))
+
+
+central_location_statistic_function_map = {'simple_moving_average': RollingMean,
+                                           'exponentially_weighed_moving_average': ExponentiallyWeightedMovingAverage,
+                                           'geometric_mean': RollingGeometricMean,
+                                           'rolling_median': RollingMedian,
+                                           'rolling_quantile': RollingQuantile}
                                            # 'simple_average': simple_average}
 
-spread_statistic_function_map = {'std_dev': std_dev, 'variance': variance}
+spread_statistic_function_map = {'std_dev': RollingStdDev, 'variance': RollingVariance,
+                                 'interquartile_range': RollingInterquartileRange}
+
+# Whole series versions of the statistics, used to backfill a stat buffer from history in one pass
+statistic_series_function_map = {'simple_moving_average': moving_average_series,
+                                 'exponentially_weighed_moving_average': ewma_series,
+                                 'geometric_mean': geometric_mean_series,
+                                 'std_dev': std_dev_series,
+                                 'variance': variance_series}
 
 
 def get_statistic_function(function_name: str, function_kwargs: dict):
     # TODO implement safety for kwargs having keyword not supported by the relevant function. Inspect the function?
     statistic_function_map = central_location_statistic_function_map | spread_statistic_function_map
     stat_function = statistic_function_map[function_name]
+    if isinstance(stat_function, type):
+        # Rolling statistics are classes, each stat buffer gets its own instance holding the rolling state
+        return stat_function(**function_kwargs)
     return functools.partial(stat_function, **function_kwargs) if function_kwargs else stat_function
 
 
 class StatBuffer(Buffer.Buffer):
     def __init__(self, name: str, data_buffer: Buffer.DataBuffer, stat_function_name: str, capacity_type: str, data_name: str,
-                 capacity: int = Buffer.DEFAULT_BUFFER_SIZE, fill_kwargs: dict = None, plot=True):
+                 capacity: int = Buffer.DEFAULT_BUFFER_SIZE, fill_kwargs: dict = None, plot=True,
+                 archive_path: str = None):
         self.data_name = data_name
         self.stat_function_name = stat_function_name
         self.fill_kwargs = fill_kwargs
@@ -99,7 +485,22 @@ class StatBuffer(Buffer.Buffer):
         else:
             self.stat_function = get_statistic_function(stat_function_name, {'data': data_buffer} | fill_kwargs)
 
-        super().__init__(name=name, capacity=capacity, capacity_type=capacity_type, fill_function=self.fill_function)
+        self._data_points_seen = data_buffer.total_points
+        archive = Archive.BufferArchive(archive_path) if archive_path else None
+        super().__init__(name=name, capacity=capacity, capacity_type=capacity_type, fill_function=self.fill_function,
+                         archive=archive)
+
+    def append(self, new_time, new_data) -> int:
+        # Values calculated elsewhere (e.g. over a whole history) for every point the data buffer holds so far
+        self._data_points_seen = self.data_buffer.total_points
+        return super().append(new_time, new_data)
+
+    def fill_next_frame(self):
+        # Only calculate a new statistic value when the data buffer has taken in new points
+        if self.data_buffer.total_points == self._data_points_seen:
+            return 0
+        self._data_points_seen = self.data_buffer.total_points
+        return super().fill_next_frame()
 
     def fill_function(self):
         return self.data_buffer.time[-1], self.stat_function()
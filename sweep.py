@@ -0,0 +1,158 @@
+import argparse
+import copy
+import csv
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import DataSources
+import State
+import backfill
+
+# Set in each worker process by _attach_history, views onto the history shared by the parent process
+_shared_history = {}
+
+
+def expand_grid(grid: dict[str, list]) -> list[dict]:
+    """Every combination of a parameter grid, keyed by dotted paths into a save file
+    (e.g. "Triggers.0.trigger_kwargs.threshold" or "CentralLocationStatistic.stat_function_kwargs.alpha")"""
+    paths = list(grid)
+    return [dict(zip(paths, values)) for values in itertools.product(*(grid[path] for path in paths))]
+
+
+def set_by_path(reference, path: str, value):
+    *parents, last = path.split('.')
+    target = reference
+    try:
+        for part in parents:
+            target = target[int(part)] if isinstance(target, list) else target[part]
+        if isinstance(target, list):
+            target[int(last)] = value
+        else:
+            target[last] = value
+    except (KeyError, IndexError, ValueError, TypeError):
+        raise ValueError(f'Parameter path "{path}" does not exist in the save file')
+
+
+def apply_parameters(save_reference: dict, parameters: dict) -> dict:
+    reference = copy.deepcopy(save_reference)
+    for path, value in parameters.items():
+        set_by_path(reference, path, value)
+    # Archives are per buffer files, every configuration writing to the same one would interleave them
+    reference.get('DataSource', {}).pop('archive_path', None)
+    for statistic_type in ('CentralLocationStatistic', 'SpreadStatistic'):
+        reference.get(statistic_type, {}).pop('archive_path', None)
+    return reference
+
+
+def _share(array: np.ndarray) -> shared_memory.SharedMemory:
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)[:] = array
+    return memory
+
+
+def _attach_history(times_name: str, data_name: str, size: int):
+    # The memory is kept referenced for the life of the worker so the views stay valid
+    times_memory = DataSources.attach_shared_memory(times_name)
+    data_memory = DataSources.attach_shared_memory(data_name)
+    times = np.ndarray((size,), dtype=np.int64, buffer=times_memory.buf)
+    data = np.ndarray((size,), dtype=np.float64, buffer=data_memory.buf)
+    times.flags.writeable = False
+    data.flags.writeable = False
+    _shared_history.update(memory=(times_memory, data_memory), times=times, data=data)
+
+
+def run_configuration(save_reference: dict, parameters: dict, frame_ms: float) -> dict:
+    state = State.State()
+    state.save_state_reference = apply_parameters(save_reference, parameters)
+    state.populate_state_from_reference()
+    for trigger_state in state.trigger_states:
+        # Only the counts are wanted, not a set of trigger files per configuration
+        trigger_state.trigger.output_to_file = False
+
+    summary = backfill.replay(state, _shared_history['times'], _shared_history['data'], frame_ms=frame_ms)
+    results = []
+    for name, chains in summary.trigger_chains.items():
+        lengths = summary.chain_lengths[name]
+        results.append({'trigger': name,
+                        'trigger_chains': chains,
+                        'mean_chain_length': float(np.mean(lengths)) if lengths else 0.0,
+                        'max_chain_length': max(lengths, default=0),
+                        # Average run length: frames evaluated per signal, the usual control chart measure
+                        'average_run_length': summary.frames / chains if chains else float('inf')})
+    return {'parameters': parameters, 'frames': summary.frames, 'triggers': results}
+
+
+def sweep(save_file: str, grid: dict[str, list], data_file: str = None, frame_ms: float = backfill.BACKFILL_FRAME_MS,
+          sample_period_ms: float = 1, max_workers: int = None) -> list[dict]:
+    """Runs every combination of the grid over the recorded data across a process pool. The data is read once and
+    shared with the workers read only."""
+    state = State.State()
+    state.open_save_file(save_file)
+    save_reference = state.save_state_reference
+    if data_file is not None:
+        save_reference['DataSource']['filepath'] = data_file
+    state.populate_data_source()
+    times, data = backfill.read_history(state.data_source, sample_period_ms=sample_period_ms)
+
+    configurations = expand_grid(grid)
+    times_memory, data_memory = _share(times), _share(data)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_attach_history,
+                                 initargs=(times_memory.name, data_memory.name, times.size)) as executor:
+            return list(executor.map(run_configuration, itertools.repeat(save_reference), configurations,
+                                     itertools.repeat(frame_ms)))
+    finally:
+        for memory in (times_memory, data_memory):
+            memory.close()
+            if sys.version_info < (3, 13) and os.name == 'posix':
+                # The workers share this process's resource tracker, so attaching took the memory off it
+                resource_tracker.register(memory._name, 'shared_memory')
+            memory.unlink()
+
+
+def write_results(results: list[dict], target_file: str):
+    parameter_names = list(results[0]['parameters']) if results else []
+    with open(target_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(parameter_names + ['trigger', 'trigger_chains', 'mean_chain_length', 'max_chain_length',
+                                           'average_run_length'])
+        for result in results:
+            for trigger in result['triggers']:
+                writer.writerow([result['parameters'][name] for name in parameter_names] +
+                                [trigger['trigger'], trigger['trigger_chains'], trigger['mean_chain_length'],
+                                 trigger['max_chain_length'], trigger['average_run_length']])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep statistic and trigger parameters of a save file over a '
+                                                 'recorded data file, reporting how often each trigger fires.')
+    parser.add_argument('save_file', help='Save file (json) holding the data source, statistics and triggers')
+    parser.add_argument('grid_file', help='Json object of dotted save file paths to lists of values to try, e.g. '
+                                          '{"Triggers.0.trigger_kwargs.threshold": [0.1, 0.2]}')
+    parser.add_argument('--data-file', default=None, help="Recorded data, defaults to the save file's data source")
+    parser.add_argument('--frame-ms', type=float, default=backfill.BACKFILL_FRAME_MS,
+                        help='Data time covered by each simulated read of the data source')
+    parser.add_argument('--sample-period-ms', type=float, default=1,
+                        help='Time between points when the data file has no timestamp column')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, defaults to every core')
+    parser.add_argument('--output', default=None, help='Csv file to write the results to')
+    args = parser.parse_args()
+
+    with open(args.grid_file) as f:
+        grid = json.load(f)
+    results = sweep(args.save_file, grid, data_file=args.data_file, frame_ms=args.frame_ms,
+                    sample_period_ms=args.sample_period_ms, max_workers=args.workers)
+    for result in results:
+        for trigger in result['triggers']:
+            print(f"{result['parameters']} {trigger['trigger']}: {trigger['trigger_chains']} chains, "
+                  f"mean length {trigger['mean_chain_length']:.1f}, ARL {trigger['average_run_length']:.1f}")
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
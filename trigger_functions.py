@@ -1,12 +1,24 @@
+import abc
+import collections
 import Trigger
+import Buffer
+import control_rules
+import functools
 import numpy as np
+import statistics
 
 
 def get_trigger_function(name: str):
-    lookup = {'High Run': high_run,
-              'Consistently Increasing': consistently_increasing,
-              'Consistently Decreasing': consistently_decreasing,
-              'Std Dev Away From Mean': std_dev_away_from_mean}
+    lookup = {'High Run': HighRun,
+              'Consistently Increasing': ConsistentlyIncreasing,
+              'Consistently Decreasing': ConsistentlyDecreasing,
+              'Std Dev Away From Mean': StdDevAwayFromMean,
+              'Western Electric Rules': functools.partial(control_chart_rules,
+                                                          rules=control_rules.WESTERN_ELECTRIC_RULES),
+              'Nelson Rules': functools.partial(control_chart_rules, rules=control_rules.NELSON_RULES)}
+    # Each rule can also be picked on its own, e.g. 'Nelson Rule 3' or 'Western Electric Rule 2'
+    for rule_name in control_rules.RULES:
+        lookup[rule_display_name(rule_name)] = functools.partial(control_chart_rules, rules=(rule_name,))
 
     return lookup[name]
 
@@ -38,3 +50,152 @@ def consistently_decreasing(trigger: Trigger.Trigger):
     abs_data = [abs(d) for d in trigger.current_data]
     return all(i > j for i, j in zip(abs_data, abs_data[1:]))
 
+
+class HighRun(Trigger.StreamingRule):
+    """Fires while every point in the window is above the threshold in magnitude. Tracks where the current run of
+    such points started."""
+    evaluates_series = True
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self):
+        self.run_start = None
+
+    def update(self, buffer: Buffer.Buffer, new_data: np.ndarray, first_index: int):
+        breaks = np.flatnonzero(np.abs(new_data) <= self.threshold)
+        if breaks.size:
+            self.run_start = first_index + int(breaks[-1]) + 1
+        elif self.run_start is None:
+            self.run_start = first_index
+
+    def fired(self, window_start: int, window_end: int) -> bool:
+        return self.run_start is not None and self.run_start <= window_start < window_end
+
+    def fired_series(self, values: np.ndarray, window_starts: np.ndarray, buffer_starts: np.ndarray) -> np.ndarray:
+        breaks = np.where(np.abs(values) <= self.threshold, np.arange(values.size), -1)
+        return np.maximum.accumulate(breaks) + 1 <= window_starts
+
+    def __call__(self, trigger: Trigger.Trigger) -> bool:
+        return high_run(trigger, threshold=self.threshold)
+
+
+class _MonotoneRun(Trigger.StreamingRule):
+    # Tracks where the current strictly monotone run of magnitudes started
+    evaluates_series = True
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.run_start = None
+        self.last_value = None
+
+    @abc.abstractmethod
+    def _continues(self, previous: np.ndarray, following: np.ndarray) -> np.ndarray:
+        ...
+
+    def update(self, buffer: Buffer.Buffer, new_data: np.ndarray, first_index: int):
+        values = np.abs(new_data)
+        if self.last_value is None:
+            self.run_start = first_index
+        else:
+            values = np.concatenate(([self.last_value], values))
+            first_index -= 1
+        breaks = np.flatnonzero(~self._continues(values[:-1], values[1:]))
+        if breaks.size:
+            # The run restarts at the point that failed to continue it
+            self.run_start = first_index + int(breaks[-1]) + 1
+        self.last_value = values[-1]
+
+    def fired(self, window_start: int, window_end: int) -> bool:
+        return self.run_start is not None and self.run_start <= window_start < window_end
+
+    def fired_series(self, values: np.ndarray, window_starts: np.ndarray, buffer_starts: np.ndarray) -> np.ndarray:
+        values = np.abs(values)
+        breaks = np.zeros(values.size, dtype=np.int64)
+        breaks[1:] = np.where(self._continues(values[:-1], values[1:]), 0, np.arange(1, values.size))
+        return np.maximum.accumulate(breaks) <= window_starts
+
+
+class ConsistentlyIncreasing(_MonotoneRun):
+    def _continues(self, previous: np.ndarray, following: np.ndarray) -> np.ndarray:
+        return previous < following
+
+    def __call__(self, trigger: Trigger.Trigger) -> bool:
+        return consistently_increasing(trigger)
+
+
+class ConsistentlyDecreasing(_MonotoneRun):
+    def _continues(self, previous: np.ndarray, following: np.ndarray) -> np.ndarray:
+        return previous > following
+
+    def __call__(self, trigger: Trigger.Trigger) -> bool:
+        return consistently_decreasing(trigger)
+
+
+class StdDevAwayFromMean(Trigger.StreamingRule):
+    """Fires when any point in the window is more than std_dev_factor standard deviations from the mean of the whole
+    buffer. The buffer's mean and deviation come from its shared rolling moments and the window's extremes from
+    monotonic queues, so each point is handled a constant number of times."""
+    evaluates_series = True
+
+    def __init__(self, std_dev_factor=1):
+        self.std_dev_factor = std_dev_factor
+        self.reset()
+
+    def reset(self):
+        self.moments = None
+        self._maxima = collections.deque()
+        self._minima = collections.deque()
+
+    def update(self, buffer: Buffer.Buffer, new_data: np.ndarray, first_index: int):
+        if self.moments is None:
+            self.moments = statistics.shared_moments(buffer, buffer.capacity, buffer.capacity_type)
+        self.moments.update()
+        for index, value in enumerate(new_data.tolist(), start=first_index):
+            while self._maxima and self._maxima[-1][1] <= value:
+                self._maxima.pop()
+            self._maxima.append((index, value))
+            while self._minima and self._minima[-1][1] >= value:
+                self._minima.pop()
+            self._minima.append((index, value))
+
+    def fired(self, window_start: int, window_end: int) -> bool:
+        for extremes in (self._maxima, self._minima):
+            while extremes and extremes[0][0] < window_start:
+                extremes.popleft()
+        if not self._maxima or self.moments is None:
+            return False
+        limit = self.std_dev_factor * np.sqrt(self.moments.variance)
+        return self._maxima[0][1] - self.moments.mean > limit or self.moments.mean - self._minima[0][1] > limit
+
+    def fired_series(self, values: np.ndarray, window_starts: np.ndarray, buffer_starts: np.ndarray) -> np.ndarray:
+        means = statistics.moving_average_series(values, buffer_starts)
+        limits = self.std_dev_factor * statistics.std_dev_series(values, buffer_starts)
+        maxima, minima = statistics.window_extremes_series(values, window_starts)
+        return (maxima - means > limits) | (means - minima > limits)
+
+    def __call__(self, trigger: Trigger.Trigger) -> bool:
+        return std_dev_away_from_mean(trigger, std_dev_factor=self.std_dev_factor)
+
+
+def rule_display_name(rule_name: str) -> str:
+    # 'western_electric_2' -> 'Western Electric Rule 2'
+    family, number = rule_name.rsplit('_', 1)
+    return f"{family.replace('_', ' ').title()} Rule {number}"
+
+
+def control_chart_rules(trigger: Trigger.Trigger, rules=control_rules.NELSON_RULES, mean=None, sigma=None):
+    # Without fixed control limits the center line and sigma are estimated from all the data in the buffer, from the
+    # rolling moments shared by every trigger and statistic over it
+    if trigger.current_data is None or len(trigger.current_data) == 0:
+        return False
+    if mean is None or sigma is None:
+        buffer = trigger.buffer
+        moments = statistics.shared_moments(buffer, buffer.capacity, buffer.capacity_type)
+        moments.update()
+        mean = moments.mean if mean is None else mean
+        sigma = np.sqrt(moments.variance) if sigma is None else sigma
+    return any(control_rules.evaluate_rules(trigger.current_data, center=mean, sigma=sigma, rules=rules).values())